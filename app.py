@@ -1,50 +1,328 @@
 #!/usr/bin/python
 # coding=UTF-8
 
+import os
+import sys
+import socket
+import getpass
+import argparse
+import subprocess
+from timeit import default_timer as timer
+
 import curses
 from curses import wrapper
 
 import locale
 locale.setlocale(locale.LC_ALL,"")
 
-from session import AnnotationSession
+from session import (AnnotationSession, SharedSession, SessionError)
 from state_manager import StateManager
 from trie_fsa import InvalidTransition
 from app_fsa import AppFSA
 from display import Display
+from span_index import (OverlapError, OVERLAP_POLICIES)
+from duplicates import (DuplicateIndex, POLICIES as DUPLICATE_POLICIES)
+from label_vocab import LabelVocab
+from op import GotoSentence
+from oplog import OpLog
+from replay import KeyRecorder
 
 from config import config
 
-def main(stdscr):
-    curses.start_color()
-    curses.curs_set(0)
+class App(object):
+    """
+    The main loop: keys go through the FSA, the operations they
+    lead to are applied to the state manager and the result displayed
 
-    fsa = AppFSA.from_config(config)
-    
-    session = AnnotationSession(".session/test", "data/20150213/sents.txt", "data/20150213/output")
-    label_groups = config["labels"].keys()
-    sm = StateManager(session, label_groups)
-    
-    display = Display(stdscr, config)
-    display.display_sentence(sm.get_display_data())
-    while True:        
-        c = stdscr.getch()        
+    Keys that are already waiting are applied in one go and drawn once
+    (or every 1 / `max_fps` seconds while keys keep coming), so that
+    drawing never lags behind key repeat
+
+    >>> from test_config import config
+    >>> from app_fsa import AppFSA
+    >>> from session import AnnotationSession
+    >>> from fake_screen import (FakeScreen, fake_curses)
+    >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+    >>> sm = StateManager(session, config["labels"].keys())
+    >>> screen = FakeScreen(keys = map(ord, "llj"))
+    >>> app = App(screen, AppFSA.from_config(config), sm, Display(screen, config, curses_lib = fake_curses))
+    >>> app.drain()
+    3
+    >>> sm.current_index, app.frames
+    (1, 1)
+    >>> sm.close()
+    >>> os.remove("data/test_data/session.pkl")
+    """
+    def __init__(self, screen, fsa, sm, display, recorder = None, max_fps = 60):
+        self.screen = screen
+        self.fsa = fsa
+        self.sm = sm
+        self.display = display
+        self.recorder = recorder
+        # moving up and down follows the wrapping on screen
+        if sm is not None:
+            sm.layout_provider = display
+
+        self.frame_interval = 1.0 / max_fps
+        self.last_frame = timer()
+        self.frames = 0
+        self.dirty = False
+        self.blocking = True
+
+    def set_blocking(self, blocking):
+        if blocking != self.blocking:
+            self.screen.nodelay(not blocking)
+            self.blocking = blocking
+
+    def read_key(self):
+        c = self.screen.getch()
+        if self.recorder is not None:
+            self.recorder.record(c)
+        return c
+
+    def transition(self, c):
+        """Feed the key to the FSA, returning the operation it completes, if any"""
         try:
             c = chr(c)
         except ValueError:
             pass
         try:
-            fsa.take(c)
+            self.fsa.take(c)
         except InvalidTransition, e:
-            display.display_error(str(e))
-            continue
-            
-        if fsa.can_terminate:
-            operation = fsa.ops[0]            
-            sm.receive(operation)            
-            display.display_sentence(sm.get_display_data())
-            fsa.reset()
+            self.display.display_error(str(e))
+            return None
+
+        if self.fsa.can_terminate:
+            operation = self.fsa.op
+            self.fsa.reset()
+            return operation
+        else:
+            return None
+
+    def apply(self, operation):
+        if isinstance(operation, GotoSentence) and operation.sent_id is None:
+            sent_id = self.prompt_number("Go to sentence: ")
+            if sent_id is None:
+                return
+            operation = GotoSentence(sent_id)
+        try:
+            self.sm.receive(operation)
+        except (OverlapError, SessionError), e:
+            self.display.display_error(str(e))
+
+    def prompt_number(self, message):
+        """
+        Read digits until Enter, None if anything else is pressed
+
+        >>> from test_config import config
+        >>> from fake_screen import (FakeScreen, fake_curses)
+        >>> screen = FakeScreen(keys = map(ord, "12\\x7f5\\n"))
+        >>> App(screen, None, None, Display(screen, config, curses_lib = fake_curses)).prompt_number("Go to: ")
+        15
+        """
+        digits = ""
+        blocking = self.blocking
+        self.set_blocking(True)
+        try:
+            while True:
+                self.display.display_error(message + digits)
+                c = self.read_key()
+                if c in (ord("\n"), ord("\r"), curses.KEY_ENTER):
+                    return int(digits) if digits else None
+                elif c in (curses.KEY_BACKSPACE, 127, 8):
+                    digits = digits[:-1]
+                elif ord("0") <= c <= ord("9"):
+                    digits += chr(c)
+                elif c != -1: # -1: no key yet
+                    return None
+        finally:
+            self.set_blocking(blocking)
+            self.display.clear_error()
+
+    def render(self, data):
+        self.display.display_sentence(data)
+
+    def flush(self):
+        """Draw the state if it changed since the last frame"""
+        if self.dirty:
+            self.render(self.sm.get_display_data())
+            self.dirty = False
+            self.last_frame = timer()
+            self.frames += 1
+
+    def handle_key(self, c, render = True):
+        """
+        Returns the operation applied, if any. Drawing is left to `flush` if not `render`
+
+        An error message stays on screen until the next key. No key (-1,
+        e.g. when a signal interrupts `getch`) is ignored
+
+        >>> from test_config import config
+        >>> from app_fsa import AppFSA
+        >>> from session import AnnotationSession
+        >>> from fake_screen import (FakeScreen, fake_curses)
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, config["labels"].keys(), overlap_policy = "reject")
+        >>> screen = FakeScreen()
+        >>> app = App(screen, AppFSA.from_config(config), sm, Display(screen, config, curses_lib = fake_curses))
+        >>> ops = [app.handle_key(ord(c)) for c in "a la"]
+        >>> print screen.line(screen.rows - 1).strip()
+        Span (0, 1) overlaps (0, 0, 'subject')
+        >>> sm.select_on
+        False
+        >>> print app.handle_key(-1), screen.line(screen.rows - 1).strip()
+        None Span (0, 1) overlaps (0, 0, 'subject')
+        >>> op = app.handle_key(ord("l")); print screen.line(screen.rows - 1).strip()
+        <BLANKLINE>
+        >>> sm.close()
+        >>> os.remove("data/test_data/session.pkl")
+        """
+        if c == -1:
+            return None
+        operation = None
+        if c == curses.KEY_RESIZE:
+            self.display.resize()
+            self.dirty = True
         else:
-            continue
-        
-wrapper(main)
+            self.display.clear_error()
+            operation = self.transition(c)
+            if operation is not None:
+                self.apply(operation)
+                self.dirty = True
+        if render:
+            self.flush()
+        return operation
+
+    def drain(self):
+        """
+        Apply the keys waiting in the input without blocking, drawing
+        at most one frame per frame interval. Returns the number of keys
+        """
+        self.set_blocking(False)
+        count = 0
+        c = self.read_key()
+        while c != -1:
+            self.handle_key(c, render = False)
+            count += 1
+            if timer() - self.last_frame >= self.frame_interval:
+                self.flush()
+            c = self.read_key()
+        self.flush()
+        return count
+
+    def run(self):
+        self.dirty = True
+        self.flush()
+        while True:
+            self.set_blocking(True)
+            c = self.read_key()
+            self.handle_key(c, render = False)
+            self.drain()
+
+def main(stdscr, args):
+    curses.start_color()
+    curses.curs_set(0)
+
+    fsa = AppFSA.from_config(config)
+
+    if args.shared_queue is not None:
+        # claims are made one at a time, when the sentence is shown
+        session = SharedSession(args.shared_queue, args.sentences, args.output, 
+                                args.annotator, args.lease, token_cache = True)
+        prefetch_depth = 0
+        oplog = OpLog("%s.%s.ops" %(args.shared_queue, args.annotator))
+    else:
+        session = AnnotationSession(args.session, args.sentences, args.output, random_access = True, 
+                                    token_cache = True)
+        prefetch_depth = args.prefetch
+        oplog = OpLog(args.session + ".ops")
+    if args.gazetteer is not None:
+        from gazetteer import Gazetteer
+        gazetteer = Gazetteer.load(args.gazetteer)
+    else:
+        gazetteer = None
+    if args.duplicates != "off":
+        duplicates = DuplicateIndex.for_file(session.sentence_path)
+    else:
+        duplicates = None
+    if args.query_index is not None:
+        from query_index import QueryIndex
+        query_index = QueryIndex(args.query_index)
+    else:
+        query_index = None
+
+    label_groups = config["labels"].keys()
+    sm = StateManager(session, label_groups, prefetch_depth = prefetch_depth, 
+                      overlap_policy = args.overlap_policy, 
+                      vocab = LabelVocab.from_config(config),
+                      gazetteer = gazetteer, prelabel = args.prelabel, oplog = oplog, 
+                      duplicates = duplicates, duplicate_policy = args.duplicates, 
+                      query_index = query_index)
+
+    display = Display(stdscr, config)
+
+    if args.record is not None:
+        recorder = KeyRecorder(args.record)
+    else:
+        recorder = None
+
+    if args.instrument is not None:
+        from instrument import (Instrument, InstrumentedApp)
+        instrument = Instrument(args.instrument, args.profile_every)
+        instrument.install_signal()
+        app = InstrumentedApp(stdscr, fsa, sm, display, instrument, recorder, args.max_fps)
+    else:
+        instrument = None
+        app = App(stdscr, fsa, sm, display, recorder, args.max_fps)
+
+    try:
+        app.run()
+    finally:
+        if instrument is not None:
+            instrument.dump()
+
+def profile_startup(args):
+    """Run the startup profiler in a fresh interpreter so that every import is counted"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup.py")
+    return subprocess.call([sys.executable, script, "--sentences", args.sentences])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sequence annotation in the terminal")
+    parser.add_argument("--session", default = ".session/test")
+    parser.add_argument("--sentences", default = "data/20150213/sents.txt")
+    parser.add_argument("--output", default = "data/20150213/output")
+    parser.add_argument("--prefetch", type = int, default = 16,
+                        help = "number of sentences tokenized ahead of time")
+    parser.add_argument("--overlap-policy", choices = OVERLAP_POLICIES, default = "replace",
+                        help = "what labeling over spans of the same label group does")
+    parser.add_argument("--gazetteer", metavar = "PATH", default = None,
+                        help = "TSV of phrase<TAB>label group<TAB>label name, whose matches are highlighted")
+    parser.add_argument("--prelabel", action = "store_true",
+                        help = "label the gazetteer matches of every sentence beforehand")
+    parser.add_argument("--duplicates", choices = DUPLICATE_POLICIES, default = "off",
+                        help = "give repeated sentences the labels of a confirmed copy, "
+                        "to review them (apply) or save them unseen (skip)")
+    parser.add_argument("--query-index", metavar = "PATH", default = None,
+                        help = "SQLite index of the labeled spans, updated as sentences are confirmed")
+    parser.add_argument("--shared-queue", metavar = "PATH", default = None,
+                        help = "claim sentences from this queue, shared with other annotators, instead of --session")
+    parser.add_argument("--annotator", default = "%s@%s" %(getpass.getuser(), socket.gethostname()),
+                        help = "name of the claims in the shared queue, to resume after a restart")
+    parser.add_argument("--lease", type = float, default = 600,
+                        help = "seconds after which the claims of an annotator that died are handed out again")
+    parser.add_argument("--max-fps", type = float, default = 60,
+                        help = "frames drawn per second at most while keys are coming in")
+    parser.add_argument("--record", metavar = "PATH", default = None,
+                        help = "log the pressed keys with their timestamps, to be fed to replay.py")
+    parser.add_argument("--instrument", metavar = "PATH", default = None,
+                        help = "time every stage of every key, writing latency histograms to PATH on exit and on SIGUSR1")
+    parser.add_argument("--profile-every", type = int, default = 0, metavar = "N",
+                        help = "with --instrument, run cProfile on one key out of N")
+    parser.add_argument("--profile-startup", action = "store_true",
+                        help = "report the import cost of every module and the time to the first frame")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        sys.exit(profile_startup(args))
+
+    wrapper(main, args)
@@ -4,7 +4,8 @@ Finite State Automaton
 from trie_fsa import TrieFSA
 from op import (Label, CancelLabel, 
                 CursorLeft, CursorRight, CursorUp, CursorDown, 
-                ConfirmSentence, SetMark)
+                ConfirmSentence, SetMark, Undo, Redo, 
+                PrevSentence, NextSentence, GotoSentence)
 
 class AppConfigError(Exception):
     pass
@@ -28,6 +29,8 @@ class AppFSA(TrieFSA):
     True
     >>> print fsa.ops #doctest: +ELLIPSIS
     [Label(is_product, product)]
+    >>> fsa.op
+    Label(is_product, product)
     """
     
     @classmethod
@@ -52,15 +55,28 @@ class AppFSA(TrieFSA):
                 else:
                     raise AppConfigError("Invalid operator name %s" %(key))
 
+        fsa.compile()
         return fsa
 
     @property
     def ops(self):
         """get all the operations starting from the current state"""
+        if self.node is not None:
+            return self.node.ops
         return [op for path, op in self.matching_paths()]
 
+    @property
+    def op(self):
+        """the operation the current state leads to, None if not unique"""
+        if self.node is not None:
+            return self.node.terminal
+        ops = self.ops
+        return ops[0] if len(ops) == 1 else None
+
     @property
     def can_terminate(self):
         """If the current state leads to only one terminal state
         """
+        if self.node is not None:
+            return self.node.terminal_count == 1
         return len(self.ops) == 1
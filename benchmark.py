@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Performance benchmarks
+
+    python benchmark.py run [--sizes 1000 10000 ...] [--only tokenize ...] [--output results.json]
+    python benchmark.py compare baseline.json results.json [--threshold 0.2]
+    python benchmark.py startup [--runs N] [--max-ms MS]
+
+Results map metric names to timings (lower is better), so a run saved with
+--output serves as the baseline of later runs
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+from timeit import default_timer as timer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORDS = ("the", "cat", "sat", "on", "a", "mat", "Apple", "sells", "phones", "in", 
+         "Berlin", "and", "it", "is", "n't", "cheap", ",", "says", "Mr.", "Smith", ".")
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(func, number = 100, repeat = 3):
+    """best time of `repeat` runs of `func` called `number` times, per call in ms"""
+    best = None
+    for _ in xrange(repeat):
+        start = timer()
+        for _ in xrange(number):
+            func()
+        elapsed = (timer() - start) / number * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_sentence(rng, length):
+    return u" ".join(rng.choice(WORDS) for _ in xrange(length))
+
+
+def make_corpus(path, size, length = 20, seed = 0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for _ in xrange(size):
+            f.write(make_sentence(rng, rng.randint(length // 2, length * 3 // 2)).encode("utf8"))
+            f.write("\n")
+
+
+def bench_tokenize(work_dir):
+    from sent import Sentence
+    rng = random.Random(0)
+    sentences = [make_sentence(rng, 25) for _ in xrange(200)]
+    Sentence.from_unicode(sentences[0]) # loads nltk
+    return {"tokenize.sentence_ms": measure(lambda: [Sentence.from_unicode(s) for s in sentences], 
+                                            number = 3) / len(sentences)}
+
+
+def bench_trie(work_dir):
+    from app_fsa import AppFSA
+    from config import config
+    fsa = AppFSA.from_config(config)
+
+    def dispatch():
+        fsa.take('l')
+        if fsa.can_terminate:
+            fsa.op
+        fsa.reset()
+
+    return {"trie.dispatch_ms": measure(dispatch, number = 10000),
+            "trie.matching_paths_ms": measure(fsa.matching_paths, number = 1000)}
+
+
+def new_state_manager(work_dir, sentence_length = 200, sentences = 1000):
+    from config import config
+    from session import AnnotationSession
+    from state_manager import StateManager
+    from label_vocab import LabelVocab
+    corpus = os.path.join(work_dir, "corpus-%d.txt" %(sentence_length))
+    make_corpus(corpus, sentences, sentence_length)
+    output_dir = tempfile.mkdtemp(dir = work_dir)
+    session = AnnotationSession(os.path.join(output_dir, "session"), corpus, output_dir, 
+                                sync_interval = None)
+    return StateManager(session, config["labels"].keys(), vocab = LabelVocab.from_config(config))
+
+
+def bench_state_manager(work_dir):
+    from op import (Label, CancelLabel, CursorLeft, CursorRight, ConfirmSentence, SetMark)
+    sm = new_state_manager(work_dir)
+    label = Label("role", "subject")
+
+    def label_and_cancel():
+        sm.receive(label)
+        sm.receive(CancelLabel())
+
+    results = {"state_manager.CursorLeft_ms": measure(lambda: sm.receive(CursorLeft()), number = 1000),
+               "state_manager.CursorRight_ms": measure(lambda: sm.receive(CursorRight()), number = 1000),
+               "state_manager.SetMark_ms": measure(lambda: sm.receive(SetMark()), number = 1000),
+               "state_manager.Label_CancelLabel_ms": measure(label_and_cancel, number = 1000),
+               "state_manager.get_display_data_ms": measure(sm.get_display_data, number = 1000)}
+    results["state_manager.ConfirmSentence_ms"] = measure(lambda: sm.receive(ConfirmSentence()), 
+                                                          number = 100, repeat = 2)
+    sm.close()
+    return results
+
+
+def bench_display(work_dir):
+    from config import config
+    from display import Display
+    from op import CursorRight
+    from fake_screen import (FakeScreen, fake_curses)
+    sm = new_state_manager(work_dir, sentences = 1)
+    display = Display(FakeScreen(40, 120), config, curses_lib = fake_curses)
+
+    def full_frame():
+        display.invalidate()
+        display.display_sentence(sm.get_display_data())
+
+    def cursor_move():
+        sm.receive(CursorRight())
+        display.display_sentence(sm.get_display_data())
+
+    results = {"display.full_frame_ms": measure(full_frame, number = 100),
+               "display.cursor_move_ms": measure(cursor_move, number = 1000)}
+    sm.close()
+    return results
+
+
+def bench_session(work_dir, sizes):
+    from session import AnnotationSession
+    from line_index import LineIndex
+    results = {}
+    for size in sizes:
+        corpus = os.path.join(work_dir, "corpus-%d.txt" %(size))
+        make_corpus(corpus, size)
+
+        # a session left at the last sentence
+        session_path = os.path.join(work_dir, "session-%d" %(size))
+        session = AnnotationSession(session_path, corpus, work_dir)
+        session.current_sent_id = size - 1
+        session.current_offset = LineIndex.build(corpus).offset(size - 1)
+        session.journal.rewrite(session.get_session_data())
+        session.close()
+
+        def resume():
+            AnnotationSession(session_path).next_sentence()
+        results["session.resume_%d_ms" %(size)] = measure(resume, number = 3)
+
+        # skipping lines when the byte offset can not be trusted
+        def resume_fallback():
+            session = AnnotationSession(session_path)
+            session.sent_file.seek(0)
+            session._seek_sentence(size - 1, None, None)
+        results["session.resume_fallback_%d_ms" %(size)] = measure(resume_fallback, number = 1)
+
+    annotation = [(w, u"-", u"-") for w in make_sentence(random.Random(0), 25).split()]
+    for output_format in ("files", "conll", "jsonl"):
+        output_dir = tempfile.mkdtemp(dir = work_dir)
+        session = AnnotationSession(os.path.join(output_dir, "session"), corpus, output_dir,
+                                    output_format = output_format, sync_interval = None)
+        session.next_sentence()
+        results["session.save_%s_ms" %(output_format)] = measure(
+            lambda: session.save_annotation(annotation), number = 200)
+        session.close()
+    return results
+
+
+BENCHMARKS = ("tokenize", "trie", "state_manager", "display", "session")
+
+def run(names = BENCHMARKS, sizes = (1000, 10000, 100000)):
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name in names:
+            if name == "session":
+                results.update(bench_session(work_dir, sizes))
+            else:
+                results.update(globals()["bench_" + name](work_dir))
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def compare(baseline, current, threshold = 0.2):
+    """
+    Metrics of `current` more than `threshold` (relative) slower than in `baseline`,
+    as [(name, baseline value, current value)]
+
+    >>> compare({"a_ms": 1.0, "b_ms": 2.0, "c_ms": 1.0}, {"a_ms": 1.1, "b_ms": 3.0, "d_ms": 5.0})
+    [('b_ms', 2.0, 3.0)]
+    """
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        if current[name] > baseline[name] * (1 + threshold):
+            regressions.append((name, baseline[name], current[name]))
+    return regressions
+
+
+def bench_startup(sentence_path, runs = 5):
+    """
+    Time to the first frame on a fake screen, each run in a fresh interpreter
+
+    Returns the medians of the in-process time (imports, setup and the first
+    draw) and of the whole process wall time, in milliseconds
+    """
+    first_frame, process = [], []
+    for _ in xrange(runs):
+        start = timer()
+        output = subprocess.check_output([sys.executable, os.path.join(HERE, "startup.py"),
+                                          "--sentences", sentence_path, "--json"])
+        process.append((timer() - start) * 1000)
+        first_frame.append(json.loads(output)["first_frame_ms"])
+    return {"first_frame_ms": median(first_frame), "process_ms": median(process)}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Run the performance benchmarks")
+    commands = parser.add_subparsers(dest = "command")
+
+    startup = commands.add_parser("startup", help = "time to the first frame")
+    startup.add_argument("--sentences", default = os.path.join(HERE, "data/test_data/sents.txt"))
+    startup.add_argument("--runs", type = int, default = 5)
+    startup.add_argument("--max-ms", type = float, default = None,
+                         help = "fail if the median time to the first frame is above this")
+
+    run_parser = commands.add_parser("run", help = "component benchmarks")
+    run_parser.add_argument("--only", nargs = "+", choices = BENCHMARKS, default = BENCHMARKS)
+    run_parser.add_argument("--sizes", nargs = "+", type = int, default = [1000, 10000, 100000],
+                            help = "corpus sizes (sentences) of the session benchmarks")
+    run_parser.add_argument("--output", default = None, help = "save the results as JSON")
+
+    compare_parser = commands.add_parser("compare", help = "flag regressions against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type = float, default = 0.2,
+                                help = "relative slow down tolerated (default: 0.2)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.only, args.sizes)
+        for name, value in sorted(results.items()):
+            print "%-40s %12.4f" %(name, value)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent = 2, sort_keys = True)
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, before, after in regressions:
+            print "%-40s %12.4f -> %12.4f (%+.0f%%)" %(name, before, after, (after / before - 1) * 100)
+        if regressions:
+            return 1
+        print "no regression above %.0f%%" %(args.threshold * 100)
+    elif args.command == "startup":
+        result = bench_startup(args.sentences, args.runs)
+        print json.dumps(result, indent = 2, sort_keys = True)
+        if args.max_ms is not None and result["first_frame_ms"] > args.max_ms:
+            print >>sys.stderr, "time to first frame %.1f ms is above %.1f ms" \
+                %(result["first_frame_ms"], args.max_ms)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
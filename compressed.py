@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Reading sentence files compressed with gzip, bzip2 or xz as a stream
+"""
+import os
+import bz2
+import zlib
+from bisect import bisect_right
+
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bzip2", ".xz": "xz"}
+
+
+class CompressionError(Exception):
+    pass
+
+
+def compression(path):
+    """
+    >>> compression("sents.txt.gz"), compression("sents.txt")
+    ('gzip', None)
+    """
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_sentence_file(path, seek_points = None):
+    """The sentence file at `path`, decompressed on the fly if it is compressed"""
+    kind = compression(path)
+    if kind is None:
+        return open(path, "rb")
+    return CompressedFile(path, kind, seek_points)
+
+
+def _lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise CompressionError("Reading .xz files needs the backports.lzma package")
+    return lzma
+
+
+class CompressedFile(object):
+    """
+    The decompressed bytes of a compressed file, read forward with
+    `readline`/`read`, and positioned with `tell`/`seek` in decompressed
+    offsets as a plain file is
+
+    Decompression goes a chunk at a time, so memory does not grow with
+    the file. A decoder can only start at the beginning of a gzip member,
+    bzip2 stream or xz stream: these boundaries are the seek points,
+    (decompressed offset, compressed offset), one recorded every
+    `seek_interval` decompressed bytes at most. Seeking starts from the
+    last point before the offset and decompresses up to it, so files made
+    of many members (e.g. by bgzip or pbzip2) resume quickly
+
+    >>> import tempfile, shutil, gzip
+    >>> d = tempfile.mkdtemp()
+    >>> with open(d + "/sents.txt.gz", "wb") as f:
+    ...     for member in ["a b c\\nd e f\\n", "g h\\n", "i j\\n"]:
+    ...         z = gzip.GzipFile(fileobj = f, mode = "wb"); n = z.write(member); z.close()
+    >>> f = CompressedFile(d + "/sents.txt.gz", "gzip", seek_interval = 4)
+    >>> [f.readline() for i in xrange(4)], f.tell(), f.readline()
+    (['a b c\\n', 'd e f\\n', 'g h\\n', 'i j\\n'], 20, '')
+    >>> points = f.seek_points; points # doctest: +ELLIPSIS
+    [(0, 0), (12, ...), (16, ...)]
+    >>> f.close()
+    >>> f = CompressedFile(d + "/sents.txt.gz", "gzip", points)
+    >>> f.seek(16); f.readline(), f.decoded
+    ('i j\\n', 4)
+    >>> f.seek(6); f.read(3), f.tell()
+    ('d e', 9)
+    >>> f.close()
+    >>> shutil.rmtree(d)
+    """
+    def __init__(self, path, kind, seek_points = None, chunk_size = 1 << 16, seek_interval = 1 << 24):
+        self.path = path
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.seek_interval = seek_interval
+        self.seek_points = sorted(seek_points) if seek_points else [(0, 0)]
+        if kind == "xz":
+            self.lzma = _lzma()
+
+        self.f = open(path, "rb")
+        self._start(*self.seek_points[0])
+
+    def _decoder(self):
+        if self.kind == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.kind == "bzip2":
+            return bz2.BZ2Decompressor()
+        else:
+            return self.lzma.LZMADecompressor()
+
+    def _start(self, pos, compressed_pos):
+        """Decompress from the member starting at `compressed_pos`, decompressed offset `pos`"""
+        self.f.seek(compressed_pos)
+        self.decoder = self._decoder()
+        # compressed data not fed to the decoder yet, and its offset
+        self.input = ""
+        self.input_pos = compressed_pos
+        # decompressed data not read yet: buffer[index:] from offset buffer_pos + index
+        self.buffer = ""
+        self.index = 0
+        self.buffer_pos = pos
+        # decompressed bytes produced, since the last start
+        self.decoded = 0
+        self.end_pos = pos
+
+    def _add_seek_point(self, pos, compressed_pos):
+        if pos - self.seek_points[-1][0] >= self.seek_interval:
+            self.seek_points.append((pos, compressed_pos))
+
+    def _decode(self):
+        """The next piece of decompressed data, "" at the end of the file"""
+        while True:
+            if not self.input:
+                self.input = self.f.read(self.chunk_size)
+                if not self.input:
+                    return ""
+            data, data_pos = self.input, self.input_pos
+            try:
+                if self.kind == "gzip":
+                    out = self.decoder.decompress(data, self.chunk_size)
+                    tail = self.decoder.unconsumed_tail
+                else:
+                    out = self.decoder.decompress(data)
+                    tail = ""
+            except EOFError: # the member ended right before `data`
+                self.decoder = self._decoder()
+                continue
+            unused = self.decoder.unused_data
+            self.input = unused + tail
+            self.input_pos = data_pos + len(data) - len(self.input)
+            self.end_pos += len(out)
+            self.decoded += len(out)
+            if unused: # next member
+                self.decoder = self._decoder()
+                if self.kind == "xz": # streams may be padded with null bytes
+                    stripped = self.input.lstrip("\0")
+                    self.input_pos += len(self.input) - len(stripped)
+                    self.input = stripped
+                self._add_seek_point(self.end_pos, self.input_pos)
+            if out:
+                return out
+
+    def _fill(self):
+        """Decompress more into the buffer, False at the end of the file"""
+        data = self._decode()
+        if not data:
+            return False
+        self.buffer_pos += self.index
+        self.buffer = self.buffer[self.index:] + data
+        self.index = 0
+        return True
+
+    def readline(self):
+        while True:
+            end = self.buffer.find("\n", self.index)
+            if end != -1 or not self._fill():
+                break
+        end = end + 1 if end != -1 else len(self.buffer)
+        line = self.buffer[self.index: end]
+        self.index = end
+        return line
+
+    def read(self, size):
+        while len(self.buffer) - self.index < size and self._fill():
+            pass
+        data = self.buffer[self.index: self.index + size]
+        self.index += len(data)
+        return data
+
+    def tell(self):
+        return self.buffer_pos + self.index
+
+    def seek(self, offset, whence = os.SEEK_SET):
+        if whence != os.SEEK_SET:
+            raise CompressionError("Compressed files are only positioned from their beginning")
+        point = self.seek_points[bisect_right(self.seek_points, (offset, float("inf"))) - 1]
+        if not (point[0] <= self.tell() <= offset):
+            if self.buffer_pos <= offset < self.buffer_pos + len(self.buffer):
+                self.index = offset - self.buffer_pos
+                return
+            self._start(*point)
+        while self.tell() < offset:
+            skip = min(offset - self.tell(), len(self.buffer) - self.index)
+            self.index += skip
+            if self.tell() < offset and not self._fill():
+                break
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def close(self):
+        self.f.close()
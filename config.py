@@ -15,4 +15,11 @@ config = {
 
     "SetMark": " ",
     "ConfirmSentence": "\n",
+
+    "PrevSentence": "[",
+    "NextSentence": "]",
+    "GotoSentence": "g",
+
+    "Undo": "u",
+    "Redo": "r",
 }
@@ -1,71 +1,290 @@
 import curses
 
+from layout import WrapLayout
+
 class DisplayData(object):
-    def __init__(self, start_index, end_index, words):
+    """
+    What to display: the words with their labels and the selected range
+
+    `changed` holds the indices of the words that changed since the data of
+    version `base` (None if everything has to be considered changed),
+    `prev_range` is the selected range at that version. `highlights`
+    holds the indices of the words to highlight, if known
+    """
+    def __init__(self, start_index, end_index, words, 
+                 changed = None, prev_range = None, base = None, version = None,
+                 highlights = None):
         self.start_index = start_index
         self.end_index = end_index
         self.words = words
+
+        self.changed = changed
+        self.prev_range = prev_range
+        self.base = base
+        self.version = version
+        self.highlights = highlights
         
     def __repr__(self):
         return "DisplayData(start=%d, end=%d, data=%r)" %(self.start_index, self.end_index, self.words)
 
+def covers(cell, other):
+    """Whether drawing `cell` overwrites everything `other` drew"""
+    return cell[:2] == other[:2] and cell[2] >= other[2] and len(cell[3]) >= len(other[3])
+
 DEFAULT_WORD_STYLE_ID = 0
 CURRENT_WORD_STYLE_ID = 1
 HIGHLIGHT_WORD_STYLE_ID = 2
 
 class Display(object):
     """Display that prints stuff on screen"""
-    def __init__(self, screen, config, highlight_words = None):
-        curses.init_pair(CURRENT_WORD_STYLE_ID, 0, curses.COLOR_WHITE)
-        curses.init_pair(HIGHLIGHT_WORD_STYLE_ID, 0, curses.COLOR_GREEN)
+    def __init__(self, screen, config, highlight_words = None, curses_lib = curses):
+        """`curses_lib` can be swapped for `fake_screen.fake_curses` to run without a terminal"""
+        self.curses = curses_lib
+        self.curses.init_pair(CURRENT_WORD_STYLE_ID, 0, self.curses.COLOR_WHITE)
+        self.curses.init_pair(HIGHLIGHT_WORD_STYLE_ID, 0, self.curses.COLOR_GREEN)
 
         self.config = config
         self.highlight_words = highlight_words
 
         self.screen = screen
-        self.max_row, self.max_col = screen.getmaxyx()        
         
         self.sent_y = 17
         
         self.instruction_y = 0
         
-        self.debug_info_y = 20
-        self.error_info_y = 22
-        
         self.word_spacing = 2
         self.line_space = 1        
-        
+
+        self.read_screen_size()
+
+        self.styles = dict((style_id, self.curses.color_pair(style_id))
+                           for style_id in (DEFAULT_WORD_STYLE_ID, CURRENT_WORD_STYLE_ID, 
+                                            HIGHLIGHT_WORD_STYLE_ID))
+        self.invalidate()
+
+    def read_screen_size(self):
+        self.max_row, self.max_col = self.screen.getmaxyx()        
+
+        # the work space ends right above these
+        self.debug_info_y = self.max_row - 2
+        self.error_info_y = self.max_row - 1
+
+    def resize(self):
+        """To be called when the terminal has been resized"""
+        self.read_screen_size()
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget what is on screen so that the next frame is drawn from scratch"""
+        self.config_drawn = False
+        self.frame = {}
+        self.cell_cache = {}
+        self.error_length = 0
+
+        self.layout = None
+        self.layout_words = None
+        self.layout_source = None # the list the layout was made for
+        self.word_cells = None
+        self.top_row = 0
+        self.version = None
         
     def display_sentence(self, data):        
-        self.screen.clear()
-        self.display_config()
+        if not self.config_drawn:
+            self.screen.clear()
+            self.display_config()
+            self.config_drawn = True
 
-        y = self.sent_y
-        x = 0
-        
-        label_number = len(data.words[0]) - 1
-        for i, word in enumerate(data.words):
-            
-            max_length = max([len(w) for w in  word])
-            if x + max_length + self.word_spacing > self.max_col:
-                y += (label_number + self.line_space + 1)
-                x = 0
+        # only the cells that differ from the previous frame are repainted
+        frame = self.layout_frame(data)
+        old_frame = self.frame
+        for i, old_cell in old_frame.iteritems():
+            cell = frame.get(i)
+            if cell is None or not covers(cell, old_cell):
+                self.erase_cell(old_cell)
+        for i, cell in frame.iteritems():
+            old_cell = old_frame.get(i)
+            if old_cell is None:
+                self.draw_cell(cell)
+            elif old_cell != cell:
+                # same word, only its style changed (e.g. cursor moved)
+                self.draw_cell(cell, word_only = old_cell[:4] == cell[:4])
+        self.frame = frame
+
+        self.screen.noutrefresh()
+        self.curses.doupdate()
+
+    def word_cell(self, word):
+        """(encoded rows, width) of a word and its labels"""
+        try:
+            return self.cell_cache[word]
+        except KeyError:
+            # words wider than the screen are cut
+            max_length_limit = max(1, self.max_col - self.word_spacing)
+            # padded to the cell width so that drawing a cell also clears it
+            max_length = min(max([len(w) for w in  word]), max_length_limit)
+            rows = tuple(stuff[:max_length].ljust(max_length).encode("utf8") for stuff in word)
+            cell = self.cell_cache[word] = (rows, max_length)
+            return cell
+
+    def wrap(self):
+        self.layout = WrapLayout([width for rows, width in self.word_cells], 
+                                 self.max_col, self.word_spacing)
+
+    def update_layout(self, words):
+        """Re-wrap the words if they are not the ones laid out last time"""
+        if self.layout is not None and words == self.layout_words:
+            self.layout_source = words
+            return
+
+        if len(self.cell_cache) > 10000:
+            self.cell_cache = {}
+
+        self.word_cells = [self.word_cell(word) for word in words]
+        self.layout_words = list(words)
+        self.layout_source = words
+        self.wrap()
+
+    def update_layout_delta(self, data):
+        """
+        Update the layout with the words in `data.changed` only
+
+        Returns whether the wrapping changed
+        """
+        rewrap = False
+        for i in data.changed:
+            cell = self.word_cell(data.words[i])
+            if cell[1] != self.word_cells[i][1]:
+                rewrap = True
+            self.word_cells[i] = cell
+            self.layout_words[i] = data.words[i]
+        if rewrap:
+            self.wrap()
+        return rewrap
+
+    def layout_of(self, words):
+        """
+        The layout on screen if it is the one of `words` (the annotation
+        list of the state manager), else a new one for them
+
+        Drawing keeps the layout up to date, only resizing drops it
+        """
+        if self.layout is not None and words is self.layout_source:
+            return self.layout
+        return WrapLayout([self.word_cell(word)[1] for word in words], 
+                          self.max_col, self.word_spacing)
+
+    def visible_row_count(self, label_number):
+        row_height = label_number + 1 + self.line_space
+        available = self.debug_info_y - self.sent_y + self.line_space
+        return max(1, available // row_height)
+
+    def follow(self, start_index, end_index, visible_rows):
+        """Scroll so that the selection (or at least its end) is visible"""
+        self.top_row = min(self.top_row, max(0, self.layout.row_count - visible_rows))
+        start_row = self.layout.row_of(start_index)
+        end_row = self.layout.row_of(end_index)
+        if start_row < self.top_row:
+            self.top_row = start_row
+        if end_row >= self.top_row + visible_rows:
+            self.top_row = end_row - visible_rows + 1
+
+    def layout_frame(self, data):
+        """
+        The cells of the visible words, index -> (y, x, width, encoded rows, style id)
+
+        Only the rows of words in the viewport are considered,
+        which follows the selection
+
+        >>> from fake_screen import (FakeScreen, fake_curses)
+        >>> from test_config import config
+        >>> d = Display(FakeScreen(rows = 24, cols = 14), config, curses_lib = fake_curses)
+        >>> words = [(u'I', u'-'), (u'love', u'predicate'), (u'it', u'-'), (u'so', u'-')]
+        >>> for i, cell in sorted(d.layout_frame(DisplayData(1, 1, words)).items()):
+        ...     print i, cell
+        0 (17, 0, 1, ('I', '-'), 0)
+        1 (17, 3, 9, ('love     ', 'predicate'), 1)
+        2 (20, 0, 2, ('it', '- '), 0)
+        3 (20, 4, 2, ('so', '- '), 0)
+        >>> d.screen.rows = 22; d.resize()
+        >>> sorted(d.layout_frame(DisplayData(1, 1, words)))
+        [0, 1]
+        >>> sorted(d.layout_frame(DisplayData(3, 3, words)))
+        [2, 3]
+        """
+        words = data.words
+        label_number = len(words[0]) - 1
+        visible_rows = self.visible_row_count(label_number)
+        top_row = self.top_row
+
+        if data.changed is not None and self.layout is not None \
+           and data.base is not None and data.base == self.version:
+            # only the changed words and the old and new selection are redone
+            rewrap = self.update_layout_delta(data)
+            self.follow(data.start_index, data.end_index, visible_rows)
+            if not rewrap and top_row == self.top_row:
+                frame = dict(self.frame)
+                dirty = set(data.changed)
+                dirty.update(xrange(data.prev_range[0], data.prev_range[1] + 1))
+                dirty.update(xrange(data.start_index, data.end_index + 1))
+                for i in dirty:
+                    if i in frame:
+                        frame[i] = self.make_cell(i, data, label_number)
+                self.version = data.version
+                return frame
+        else:
+            self.update_layout(words)
+            self.follow(data.start_index, data.end_index, visible_rows)
+
+        frame = {}
+        for i in self.layout.words_in_rows(self.top_row, self.top_row + visible_rows):
+            frame[i] = self.make_cell(i, data, label_number)
+        self.version = data.version
+        return frame
+
+    def make_cell(self, i, data, label_number):
+        word = data.words[i]
+        rows, max_length = self.word_cells[i]
+        row, x = self.layout.position(i)
+        y = self.sent_y + (row - self.top_row) * (label_number + 1 + self.line_space)
             
-            for y_offset, stuff in enumerate(word):
-                if y_offset == 0 and i >= data.start_index and i<= data.end_index:
-                    style_id = CURRENT_WORD_STYLE_ID
-                elif self.highlight_words is not None and y_offset == 0 \
-                     and stuff.lower() in self.highlight_words: #highlight the trigger words if necessary
-                    style_id = HIGHLIGHT_WORD_STYLE_ID
-                else:
-                    style_id = DEFAULT_WORD_STYLE_ID
-
-                self.screen.addstr(y+y_offset, x, stuff.encode("utf8"), curses.color_pair(style_id))
-                    
-            x += (max_length + self.word_spacing)
+        if i >= data.start_index and i<= data.end_index:
+            style_id = CURRENT_WORD_STYLE_ID
+        elif data.highlights is not None and i in data.highlights: # gazetteer matches
+            style_id = HIGHLIGHT_WORD_STYLE_ID
+        elif self.highlight_words is not None \
+             and word[0].lower() in self.highlight_words: #highlight the trigger words if necessary
+            style_id = HIGHLIGHT_WORD_STYLE_ID
+        else:
+            style_id = DEFAULT_WORD_STYLE_ID
+
+        return (y, x, max_length, rows, style_id)
+
+    def draw_cell(self, cell, word_only = False):
+        y, x, width, rows, style_id = cell
+        if word_only:
+            rows = rows[:1]
+        for y_offset, stuff in enumerate(rows):
+            if y_offset == 0:
+                style = self.styles[style_id]
+            else:
+                style = self.styles[DEFAULT_WORD_STYLE_ID]
+            self.screen.addstr(y+y_offset, x, stuff, style)
+
+    def erase_cell(self, cell):
+        y, x, width, rows, style_id = cell
+        blank = " " * width
+        for y_offset in xrange(len(rows)):
+            self.screen.addstr(y+y_offset, x, blank)
+
+    def clear_error(self):
+        if self.error_length > 0:
+            self.screen.addstr(self.error_info_y, 0, " " * self.error_length)
+            self.error_length = 0
             
     def display_error(self, data):
+        self.clear_error()
         self.screen.addstr(self.error_info_y, 0, data)
+        self.error_length = len(data)
 
     def display_pressed_key(self, c):
         self.screen.addch(self.debug_info_y, 0, c)
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Sentences of a file that occur more than once, to reuse the labels of a confirmed copy
+"""
+import os
+import heapq
+import codecs
+import struct
+import hashlib
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+try:
+    from cPickle import (load, dump)
+except ImportError:
+    from pickle import (load, dump)
+
+from line_index import (file_fingerprint, StaleIndexError)
+from compressed import open_sentence_file
+
+INDEX_SUFFIX = ".dup"
+INDEX_VERSION = 1
+LINKS_FILE = "duplicates.tsv"
+
+POLICIES = ("off", "apply", "skip")
+
+HASH = struct.Struct("<q")
+# (hash, line number) in the sorted runs of `DuplicateIndex.build`
+RUN_RECORD = struct.Struct("<qI")
+
+
+def line_hash(line):
+    """
+    64 bit hash of a line, whitespace aside
+
+    >>> line_hash(" a  b\\n") == line_hash(u"a b") != line_hash("a  c")
+    True
+    """
+    if isinstance(line, unicode):
+        line = line.encode("utf8")
+    return HASH.unpack_from(hashlib.md5(" ".join(line.split())).digest())[0]
+
+
+def _read_run(f, chunk_records = 1 << 14):
+    """The (hash, line number) records of a sorted run file, read a chunk at a time"""
+    f.seek(0)
+    for chunk in iter(lambda: f.read(RUN_RECORD.size * chunk_records), ""):
+        for offset in xrange(0, len(chunk), RUN_RECORD.size):
+            yield RUN_RECORD.unpack_from(chunk, offset)
+
+
+class DuplicateIndex(object):
+    """
+    Line numbers of the lines with the same content as another line,
+    sorted by (hash of the content, line number)
+
+    Lines occurring once are left out, so that the index of a corpus
+    of tens of millions of lines stays as small as its repetitions.
+    It is built in one streaming pass, sorting chunks of lines into
+    temporary files then merging them, so that only a chunk is in memory
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> with open(d + "/sents.txt", "w") as f:
+    ...     f.write("a b\\nc\\na  b\\nd\\nc\\na b\\n")
+    >>> index = DuplicateIndex.build(d + "/sents.txt", chunk_lines = 2)
+    >>> len(index), index.copies(u"a b"), index.copies(u"c"), index.copies(u"d")
+    (5, [0, 2, 5], [1, 4], [])
+    >>> index.save(d + "/sents.txt.dup")
+    >>> DuplicateIndex.for_file(d + "/sents.txt").copies(u"a b")
+    [0, 2, 5]
+    >>> shutil.rmtree(d)
+    """
+    def __init__(self, hashes, sent_ids, fingerprint):
+        self.hashes = hashes
+        self.sent_ids = sent_ids
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, path, chunk_lines = 1 << 20):
+        fingerprint = file_fingerprint(path)
+
+        # sorted runs of (hash, line number), each in a temporary file
+        runs = []
+        def add_run(pairs):
+            pairs.sort()
+            run = tempfile.TemporaryFile()
+            runs.append(run)
+            run.write("".join(RUN_RECORD.pack(h, i) for h, i in pairs))
+
+        try:
+            pairs = []
+            f = open_sentence_file(path)
+            try:
+                for line_no, line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    pairs.append((line_hash(line), line_no))
+                    if len(pairs) >= chunk_lines:
+                        add_run(pairs)
+                        pairs = []
+            finally:
+                f.close()
+            if pairs:
+                add_run(pairs)
+            del pairs
+
+            hashes, sent_ids = array("l"), array("I")
+            merged = heapq.merge(*[_read_run(run) for run in runs])
+            for h, group in groupby(merged, key = lambda pair: pair[0]):
+                group = list(group)
+                if len(group) > 1:
+                    for h, sent_id in group:
+                        hashes.append(h)
+                        sent_ids.append(sent_id)
+        finally:
+            for run in runs:
+                run.close()
+        return cls(hashes, sent_ids, fingerprint)
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, "rb") as f:
+            header = load(f)
+            if header.get("version") != INDEX_VERSION:
+                raise StaleIndexError("Unknown index version in '%s'" %(index_path))
+            hashes, sent_ids = array("l"), array("I")
+            hashes.fromfile(f, header["count"])
+            sent_ids.fromfile(f, header["count"])
+        return cls(hashes, sent_ids, header["fingerprint"])
+
+    @classmethod
+    def for_file(cls, path, index_path = None):
+        """
+        Load the sidecar index of `path`, (re)building it if
+        it is missing or the file has changed since it was built
+        """
+        if index_path is None:
+            index_path = path + INDEX_SUFFIX
+
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+            except (StaleIndexError, EOFError, ValueError):
+                index = None
+            if index is not None and index.is_fresh(path):
+                return index
+
+        index = cls.build(path)
+        try:
+            index.save(index_path)
+        except (IOError, OSError):
+            pass
+        return index
+
+    def save(self, index_path):
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            dump({"version": INDEX_VERSION,
+                  "fingerprint": self.fingerprint,
+                  "count": len(self.hashes)}, f, 2)
+            self.hashes.tofile(f)
+            self.sent_ids.tofile(f)
+        os.rename(tmp_path, index_path)
+
+    def is_fresh(self, path):
+        return file_fingerprint(path) == tuple(self.fingerprint)
+
+    def copies(self, line):
+        """Line numbers of the lines with the content of `line`, none if it occurs once"""
+        h = line_hash(line)
+        i = bisect_left(self.hashes, h)
+        ids = []
+        while i < len(self.hashes) and self.hashes[i] == h:
+            ids.append(int(self.sent_ids[i]))
+            i += 1
+        return ids
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def record_link(output_dir, sent_id, original_id, policy):
+    """Note in `output_dir` that the labels of `sent_id` were taken from `original_id`"""
+    with codecs.open(os.path.join(output_dir, LINKS_FILE), "a", "utf8") as f:
+        f.write(u"%d\t%d\t%s\n" %(sent_id, original_id, policy))
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Exporting the saved annotations as one corpus
+
+    python export.py OUTPUT_DIR INPUT_DIR [INPUT_DIR ...] [--format conll|jsonl|columns]
+                     [--input-format files|conll|jsonl] [--processes N] [--incremental]
+
+Sentences are read and formatted by a process pool in batches and written
+in sentence id order, so that memory stays bounded whatever the corpus size.
+With --incremental, every run writes the sentences confirmed since the
+previous one to a new part (`part-00000`, `part-00001`, ...): a sentence
+confirmed again shows up in a later part, which supersedes the earlier ones
+"""
+import os
+import json
+import heapq
+import argparse
+from array import array
+from itertools import (islice, izip, repeat)
+from timeit import default_timer as timer
+
+from store import (open_store, INDEX_FILE, INDEX_RECORD)
+
+FORMATS = ("conll", "jsonl", "columns")
+STATE_FILE = "export.state"
+# how far back from the latest modification seen files are checked again,
+# for coarse file times and files showing up late
+MTIME_MARGIN = 2.0
+
+
+def encode(sent_id, rows, groups, format):
+    """
+    The record(s) of one sentence: one byte string per output file
+
+    >>> encode(3, [(u'a', u'-', u'VB'), (u'b', u'PER', u'-')], ["ner", "pos"], "conll")
+    ['# sent_id = 3\\na\\t-\\tVB\\nb\\tPER\\t-\\n\\n']
+    >>> encode(3, [(u'a', u'-', u'VB')], ["ner", "pos"], "jsonl")
+    ['{"labels": {"ner": ["-"], "pos": ["VB"]}, "sent_id": 3, "tokens": ["a"]}\\n']
+    >>> encode(3, [(u'a', u'-', u'VB')], ["ner", "pos"], "columns")
+    ['a\\t-\\n\\n', 'a\\tVB\\n\\n']
+    """
+    if format == "conll":
+        lines = [u"# sent_id = %d" %(sent_id)] + [u"\t".join(row) for row in rows]
+        return [(u"\n".join(lines) + u"\n\n").encode("utf8")]
+    elif format == "jsonl":
+        record = {"sent_id": sent_id,
+                  "tokens": [row[0] for row in rows],
+                  "labels": dict((group, [row[i + 1] for row in rows])
+                                 for i, group in enumerate(groups))}
+        return [(json.dumps(record, ensure_ascii = False, sort_keys = True) + u"\n").encode("utf8")]
+    else:
+        return [(u"".join(u"%s\t%s\n" %(row[0], row[i + 1]) for row in rows) + u"\n").encode("utf8")
+                for i in xrange(len(groups))]
+
+
+def output_names(format, groups, part = None):
+    """
+    >>> output_names("conll", ["ner", "pos"]), output_names("columns", ["ner", "pos"], 2)
+    (['corpus.conll'], ['ner-00002.tsv', 'pos-00002.tsv'])
+    """
+    if format == "columns":
+        stems, ext = list(groups), "tsv"
+    else:
+        stems, ext = ["corpus" if part is None else "part"], format
+    if part is None:
+        return ["%s.%s" %(stem, ext) for stem in stems]
+    return ["%s-%05d.%s" %(stem, part, ext) for stem in stems]
+
+
+def pending(input_dir, input_format, watermark):
+    """
+    Ids of the sentences saved in `input_dir` since `watermark` (all if None)
+    and the watermark to resume from next time
+
+    The watermark of the "files" layout is a time shortly before the
+    latest modification seen, with the modification times of the files
+    exported since then: files modified later are new, unless they were
+    exported with the same time. Segmented stores have an append-only
+    index, whose length is the watermark
+
+    >>> import tempfile, shutil
+    >>> from store import FileStore
+    >>> d = tempfile.mkdtemp()
+    >>> FileStore(d).write(0, [(u'a', u'-')])
+    >>> ids, watermark = pending(d, "files", None); ids
+    [0]
+    >>> FileStore(d).write(1, [(u'b', u'-')])
+    >>> ids, watermark = pending(d, "files", watermark); ids
+    [1]
+    >>> pending(d, "files", watermark)[0]
+    []
+    >>> shutil.rmtree(d)
+    """
+    if input_format == "files":
+        since, exported = None, {}
+        if watermark is not None:
+            since = watermark["time"]
+            exported = dict((sent_id, mtime) for sent_id, mtime in watermark["exported"])
+
+        ids = array("l")
+        mtimes = {} # of the files modified since `since`
+        for name in os.listdir(input_dir):
+            if not (name.endswith(".txt") and name[:-4].isdigit()):
+                continue
+            mtime = os.stat(os.path.join(input_dir, name)).st_mtime
+            if since is not None and mtime < since:
+                continue
+            sent_id = int(name[:-4])
+            mtimes[sent_id] = mtime
+            if exported.get(sent_id) != mtime:
+                ids.append(sent_id)
+
+        new_since = since
+        if mtimes:
+            latest = max(mtimes.itervalues()) - MTIME_MARGIN
+            new_since = latest if since is None else max(since, latest)
+        return sorted(ids), {"time": new_since,
+                             "exported": sorted((sent_id, mtime) for sent_id, mtime in mtimes.iteritems()
+                                                if mtime >= new_since)}
+    else:
+        index_path = os.path.join(input_dir, INDEX_FILE)
+        start = watermark or 0
+        if not os.path.exists(index_path):
+            return [], start
+        with open(index_path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        end = len(data) // INDEX_RECORD.size * INDEX_RECORD.size # a torn record is read next time
+        ids = set(INDEX_RECORD.unpack_from(data, i)[0] for i in xrange(0, end, INDEX_RECORD.size))
+        return sorted(ids), start + end
+
+
+_stores = None
+_job = None
+
+def _init_worker(inputs, input_format, groups, format):
+    global _stores, _job
+    _stores = [open_store(input_dir, input_format) for input_dir in inputs]
+    _job = (groups, format)
+
+def _encode_batch(batch):
+    """records of the (input number, sentence id) pairs of `batch`, concatenated per output file"""
+    groups, format = _job
+    outputs = None
+    for input_no, sent_id in batch:
+        records = encode(sent_id, _stores[input_no].read(sent_id), groups, format)
+        if outputs is None:
+            outputs = [[] for _ in records]
+        for out, record in zip(outputs, records):
+            out.append(record)
+    return ["".join(out) for out in outputs]
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export(output_dir, inputs, groups, format = "conll", input_format = "files",
+           processes = None, incremental = False, batch_size = 256):
+    """
+    Export the sentences of the stores in `inputs` to `output_dir`,
+    returning how many were written. A sentence saved in several inputs
+    is taken from the first
+
+    >>> import tempfile, shutil
+    >>> from store import FileStore
+    >>> d = tempfile.mkdtemp()
+    >>> store = FileStore(d)
+    >>> store.write(1, [(u'b', u'PER', u'-')]); store.write(0, [(u'a', u'-', u'VB')])
+    >>> export(d + "/corpus", [d], ["ner", "pos"], processes = 1)
+    2
+    >>> print open(d + "/corpus/corpus.conll").read().replace("\\t", "|")
+    # sent_id = 0
+    a|-|VB
+    <BLANKLINE>
+    # sent_id = 1
+    b|PER|-
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> export(d + "/parts", [d], ["ner", "pos"], "columns", processes = 1, incremental = True)
+    2
+    >>> store.write(2, [(u'c', u'ORG', u'-')])
+    >>> export(d + "/parts", [d], ["ner", "pos"], "columns", processes = 1, incremental = True)
+    1
+    >>> print open(d + "/parts/ner-00001.tsv").read().replace("\\t", "|")
+    c|ORG
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> shutil.rmtree(d)
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown export format %r" %(format))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {"part": 0, "watermarks": {}}
+    if incremental and os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    # (sent id, input number) of every sentence to export, in id order
+    id_lists, watermarks = [], {}
+    for input_no, input_dir in enumerate(inputs):
+        key = os.path.abspath(input_dir)
+        ids, watermarks[key] = pending(input_dir, input_format,
+                                       state["watermarks"].get(key) if incremental else None)
+        id_lists.append(izip(ids, repeat(input_no)))
+
+    def unique(merged):
+        last = None
+        for sent_id, input_no in merged:
+            if sent_id != last:
+                yield input_no, sent_id
+                last = sent_id
+
+    if incremental:
+        names = output_names(format, groups, state["part"])
+    else:
+        names = output_names(format, groups)
+    tmp_paths = [os.path.join(output_dir, name + ".tmp") for name in names]
+    files = [open(path, "wb") for path in tmp_paths]
+
+    initargs = (inputs, input_format, groups, format)
+    if processes == 1:
+        _init_worker(*initargs)
+        pool, imap = None, map
+    else:
+        from multiprocessing import Pool
+        from multiprocessing import cpu_count
+        pool = Pool(processes, _init_worker, initargs)
+        imap = pool.imap
+        processes = processes or cpu_count()
+
+    count = 0
+    try:
+        # a window of batches at a time keeps the memory bounded
+        window = batch_size * 4 * (processes or 1)
+        for ids in batches(unique(heapq.merge(*id_lists)), window):
+            for outputs in imap(_encode_batch, list(batches(ids, batch_size))):
+                for f, data in zip(files, outputs):
+                    f.write(data)
+            count += len(ids)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for f in files:
+            f.close()
+
+    if incremental and count == 0:
+        for path in tmp_paths:
+            os.remove(path)
+        return 0
+    for path, name in zip(tmp_paths, names):
+        os.rename(path, os.path.join(output_dir, name))
+
+    if incremental:
+        state = {"part": state["part"] + 1,
+                 "watermarks": dict(state["watermarks"], **watermarks)}
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.rename(state_path + ".tmp", state_path)
+    return count
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Export the saved annotations as one corpus")
+    parser.add_argument("output_dir")
+    parser.add_argument("inputs", nargs = "+", help = "output directories of the annotation sessions")
+    parser.add_argument("--format", choices = FORMATS, default = "conll")
+    parser.add_argument("--input-format", choices = ("files", "conll", "jsonl"), default = "files")
+    parser.add_argument("--processes", type = int, default = None,
+                        help = "size of the process pool (default: one per CPU)")
+    parser.add_argument("--incremental", action = "store_true",
+                        help = "only export the sentences saved since the previous run, to a new part")
+    args = parser.parse_args(argv)
+
+    from config import config
+    start = timer()
+    count = export(args.output_dir, args.inputs, config["labels"].keys(), args.format,
+                   args.input_format, args.processes, args.incremental)
+    print "%d sentences exported in %.1f s" %(count, timer() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+In-memory stand-ins for a curses screen, for running without a terminal
+"""
+import curses
+from collections import deque
+
+
+class FakeCurses(object):
+    """
+    The parts of the `curses` module that `Display` uses,
+    without requiring `initscr()`
+    """
+    error = curses.error
+
+    COLOR_BLACK = curses.COLOR_BLACK
+    COLOR_WHITE = curses.COLOR_WHITE
+    COLOR_GREEN = curses.COLOR_GREEN
+
+    A_NORMAL = curses.A_NORMAL
+    A_BOLD = curses.A_BOLD
+    A_REVERSE = curses.A_REVERSE
+
+    KEY_RESIZE = curses.KEY_RESIZE
+    KEY_BACKSPACE = curses.KEY_BACKSPACE
+
+    def __init__(self):
+        self.updates = 0
+
+    def init_pair(self, pair_id, fg, bg):
+        pass
+
+    def color_pair(self, pair_id):
+        return pair_id << 8
+
+    def start_color(self):
+        pass
+
+    def curs_set(self, visibility):
+        pass
+
+    def doupdate(self):
+        self.updates += 1
+
+
+fake_curses = FakeCurses()
+
+
+class FakeScreen(object):
+    """
+    A curses window writing into a grid of characters
+
+    >>> screen = FakeScreen(rows = 3, cols = 10, keys = [ord('j'), ord('l')])
+    >>> screen.addstr(1, 2, u"\\u20acok".encode("utf8"))
+    >>> print screen.line(1).encode("utf8")
+      €ok
+    >>> screen.getch(), screen.getch(), screen.getch()
+    (106, 108, -1)
+    >>> screen.addstr(3, 0, "x") # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    error: ...
+    """
+
+    def __init__(self, rows = 40, cols = 120, keys = ()):
+        self.rows = rows
+        self.cols = cols
+        self.keys = deque(keys)
+        self.writes = 0
+        self.delay = True
+        self.clear()
+
+    def getmaxyx(self):
+        return self.rows, self.cols
+
+    def addstr(self, y, x, s, attr = 0):
+        if isinstance(s, str):
+            s = s.decode("utf8")
+        if not (0 <= y < self.rows and 0 <= x < self.cols):
+            raise curses.error("addstr() returned ERR")
+        self.writes += 1
+        for c in s: # wraps around like curses does
+            if y >= self.rows:
+                raise curses.error("addstr() returned ERR")
+            self.grid[y][x] = c
+            x += 1
+            if x == self.cols:
+                y, x = y + 1, 0
+
+    def addch(self, y, x, c, attr = 0):
+        if isinstance(c, int):
+            c = unichr(c)
+        self.addstr(y, x, c, attr)
+
+    def move(self, y, x):
+        pass
+
+    def clrtoeol(self):
+        pass
+
+    def clear(self):
+        self.grid = [[u" "] * self.cols for _ in xrange(self.rows)]
+
+    erase = clear
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = not flag
+
+    def getch(self):
+        if self.keys:
+            return self.keys.popleft()
+        return -1
+
+    def line(self, y):
+        return u"".join(self.grid[y]).rstrip()
+
+    def __unicode__(self):
+        return u"\n".join(self.line(y) for y in xrange(self.rows))
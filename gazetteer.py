@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Phrase dictionaries matched against sentences, to highlight and pre-label spans
+"""
+import codecs
+from array import array
+from collections import deque
+
+ROOT = 0
+
+
+class Gazetteer(object):
+    """
+    An Aho-Corasick automaton over lowercased tokens, mapping phrases
+    (token sequences) to (label group, label name)
+
+    Finding the matches in a sentence takes one transition per token plus
+    one step per match, whatever the number of phrases. Transitions live in
+    one dict keyed by `state << 32 | token id` and the failure and output
+    links in arrays, to keep large dictionaries compact
+
+    >>> g = Gazetteer([([u"new", u"york"], "loc", "city"),
+    ...                ([u"new", u"york", u"times"], "org", "company"),
+    ...                ([u"york"], "loc", "city"),
+    ...                ([u"times"], "misc", "word")])
+    >>> g.find([u"The", u"New", u"York", u"Times", u"says"])
+    [(1, 2, 'loc', 'city'), (2, 2, 'loc', 'city'), (1, 3, 'org', 'company'), (3, 3, 'misc', 'word')]
+    >>> g.find([u"new", u"new", u"york"])
+    [(1, 2, 'loc', 'city'), (2, 2, 'loc', 'city')]
+    >>> g.longest_matches([u"The", u"New", u"York", u"Times", u"says"])
+    [(1, 2, 'loc', 'city'), (1, 3, 'org', 'company'), (3, 3, 'misc', 'word')]
+    """
+    def __init__(self, entries = ()):
+        self.token_ids = {}
+        self.goto = {}
+        self.depth = array("l", [0])
+        self.labels = [] # distinct (group, name)
+        label_ids = {}
+        # state -> ids of the labels of the phrase ending there
+        self.outputs = {}
+
+        children = [[]]
+        for tokens, group, name in entries:
+            state = ROOT
+            for token in tokens:
+                token_id = self.token_ids.setdefault(token.lower(), len(self.token_ids))
+                key = state << 32 | token_id
+                next_state = self.goto.get(key)
+                if next_state is None:
+                    next_state = self.goto[key] = len(self.depth)
+                    self.depth.append(self.depth[state] + 1)
+                    children[state].append(next_state)
+                    children.append([])
+                state = next_state
+            label = (group, name)
+            if label not in label_ids:
+                label_ids[label] = len(self.labels)
+                self.labels.append(label)
+            state_labels = self.outputs.setdefault(state, [])
+            if label_ids[label] not in state_labels:
+                state_labels.append(label_ids[label])
+
+        self._link(children)
+
+    def _link(self, children):
+        """failure links, and links to the nearest state of the failure chain with an output"""
+        state_count = len(self.depth)
+        self.fail = array("l", [ROOT]) * state_count
+        self.output_link = array("l", [ROOT]) * state_count
+
+        # token id of the transition into every state
+        token_of = array("l", [0]) * state_count
+        for key, state in self.goto.iteritems():
+            token_of[state] = key & 0xffffffff
+
+        queue = deque(children[ROOT])
+        while queue:
+            state = queue.popleft()
+            for child in children[state]:
+                queue.append(child)
+                token_id = token_of[child]
+                fallback = self.fail[state]
+                target = self.goto.get(fallback << 32 | token_id)
+                while target is None and fallback != ROOT:
+                    fallback = self.fail[fallback]
+                    target = self.goto.get(fallback << 32 | token_id)
+                if target is None or target == child:
+                    target = ROOT
+                self.fail[child] = target
+                self.output_link[child] = target if target in self.outputs else self.output_link[target]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a TSV file of `phrase<TAB>group<TAB>name` lines,
+        the phrase tokenized as the sentences are, tokens separated by spaces
+        """
+        def entries():
+            with codecs.open(path, "r", "utf8") as f:
+                for line in f:
+                    line = line.rstrip(u"\n")
+                    if not line.strip() or line.startswith(u"#"):
+                        continue
+                    phrase, group, name = line.split(u"\t")
+                    yield phrase.split(), group, name
+        return cls(entries())
+
+    def find(self, tokens):
+        """All matches as (start, end, group, name), `end` inclusive, ordered by end"""
+        goto, fail, depth = self.goto, self.fail, self.depth
+        outputs, output_link, labels = self.outputs, self.output_link, self.labels
+        matches = []
+        state = ROOT
+        for i, token in enumerate(tokens):
+            token_id = self.token_ids.get(token.lower())
+            if token_id is None:
+                state = ROOT
+                continue
+            next_state = goto.get(state << 32 | token_id)
+            while next_state is None and state != ROOT:
+                state = fail[state]
+                next_state = goto.get(state << 32 | token_id)
+            state = next_state if next_state is not None else ROOT
+
+            match = state if state in outputs else output_link[state]
+            while match != ROOT:
+                for label_id in outputs[match]:
+                    group, name = labels[label_id]
+                    matches.append((i - depth[match] + 1, i, group, name))
+                match = output_link[match]
+        return sorted(matches, key = lambda m: (m[1], m[0]))
+
+    def longest_matches(self, tokens):
+        """Non-overlapping matches of every label group, preferring the leftmost then the longest"""
+        chosen = []
+        last_end = {}
+        for start, end, group, name in sorted(self.find(tokens), key = lambda m: (m[0], m[0] - m[1])):
+            if start > last_end.get(group, -1):
+                chosen.append((start, end, group, name))
+                last_end[group] = end
+        return sorted(chosen)
+
+    def __len__(self):
+        return len(self.outputs)
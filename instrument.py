@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Opt-in latency instrumentation of the main loop
+
+Every key is timed stage by stage (waiting in getch, FSA transition,
+`StateManager.receive`, `get_display_data` and rendering) into histograms
+per operation class. Nothing of this runs unless `InstrumentedApp`
+is used in place of `App`
+"""
+import sys
+import signal
+import resource
+import curses
+from array import array
+from timeit import default_timer as timer
+
+from app import App
+
+STAGES = ("fsa", "receive", "display_data", "render", "total")
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in microseconds, in HDR-style log-linear buckets:
+    exact below 64 µs, then 32 buckets per power of two (about 3% error)
+    so that recording is O(1) and the memory is fixed whatever the count
+
+    >>> h = LatencyHistogram()
+    >>> for us in [5, 10, 10, 20, 1000, 5000]:
+    ...     h.record(us)
+    >>> h.count, h.min, h.max
+    (6, 5, 5000)
+    >>> h.percentile(50), h.percentile(100)
+    (10, 5000)
+    >>> h.percentile(80) # 1000 falls in the bucket 992...1007
+    999
+    """
+    SUB_BUCKETS = 64
+    HALF = SUB_BUCKETS // 2
+    SUB_BITS = 6
+    MAX_SHIFT = 32
+
+    def __init__(self):
+        self.counts = array("L", [0] * (self.SUB_BUCKETS + self.HALF * self.MAX_SHIFT))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, us):
+        if us < self.SUB_BUCKETS:
+            return us
+        shift = min(us.bit_length() - self.SUB_BITS, self.MAX_SHIFT)
+        return self.SUB_BUCKETS + (shift - 1) * self.HALF + min((us >> shift) - self.HALF, self.HALF - 1)
+
+    def bucket_value(self, i):
+        """middle of the latencies falling in bucket i"""
+        if i < self.SUB_BUCKETS:
+            return i
+        shift = (i - self.SUB_BUCKETS) // self.HALF + 1
+        low = ((i - self.SUB_BUCKETS) % self.HALF + self.HALF) << shift
+        return low + ((1 << shift) - 1) // 2
+
+    def record(self, us):
+        self.counts[self.bucket(us)] += 1
+        self.count += 1
+        self.total += us
+        if self.min is None or us < self.min:
+            self.min = us
+        if self.max is None or us > self.max:
+            self.max = us
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return max(self.min, min(self.bucket_value(i), self.max))
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0.0
+
+    def summary(self):
+        """count and latencies in ms"""
+        return {"count": self.count,
+                "mean": self.mean / 1000,
+                "p50": self.percentile(50) / 1000.0,
+                "p90": self.percentile(90) / 1000.0,
+                "p99": self.percentile(99) / 1000.0,
+                "max": (self.max or 0) / 1000.0}
+
+
+class Instrument(object):
+    """
+    Histograms by operation class and stage, the getch wait, and
+    optionally a cProfile profile sampled on one key out of `profile_every`
+
+    >>> instrument = Instrument()
+    >>> instrument.record("CursorLeft", "fsa", 0.000012)
+    >>> instrument.record("CursorLeft", "fsa", 0.000020)
+    >>> instrument.summary()["ops"]["CursorLeft"]["fsa"]["count"]
+    2
+    """
+    def __init__(self, output = None, profile_every = 0):
+        self.output = output
+        self.histograms = {}
+        self.wait = LatencyHistogram()
+        self.profile_every = profile_every
+        self.keys = 0
+        if profile_every:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = None
+
+    def record(self, op_name, stage, seconds):
+        key = (op_name, stage)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        self.histograms[key].record(int(seconds * 1000000))
+
+    def summary(self):
+        ops = {}
+        for (op_name, stage), histogram in self.histograms.items():
+            ops.setdefault(op_name, {})[stage] = histogram.summary()
+        return {"keys": self.keys,
+                "getch_wait": self.wait.summary(),
+                "ops": ops,
+                # tracemalloc does not exist in Python 2: the peak resident size is the memory figure
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    def format_summary(self):
+        result = self.summary()
+        lines = ["%d keys, max RSS %d kB" %(result["keys"], result["max_rss_kb"]),
+                 "",
+                 "%-16s %-13s %8s %9s %9s %9s %9s %9s" %("op", "stage", "count", "mean", "p50", "p90", "p99", "max")]
+        rows = [("(getch wait)", "", result["getch_wait"])]
+        for op_name, stages in sorted(result["ops"].items()):
+            rows += [(op_name, stage, stages[stage]) for stage in STAGES if stage in stages]
+        for op_name, stage, stats in rows:
+            lines.append("%-16s %-13s %8d %9.3f %9.3f %9.3f %9.3f %9.3f"
+                         %(op_name, stage, stats["count"], stats["mean"], stats["p50"],
+                           stats["p90"], stats["p99"], stats["max"]))
+        lines.append("(latencies in ms, op None: key that did not complete an operation)")
+
+        if self.profiler is not None:
+            import pstats
+            from StringIO import StringIO
+            out = StringIO()
+            stats = pstats.Stats(self.profiler, stream = out)
+            stats.sort_stats("cumulative").print_stats(25)
+            lines += ["", "profile of 1 key in %d:" %(self.profile_every), out.getvalue()]
+        return "\n".join(lines)
+
+    def dump(self, *args):
+        """Write the summary to `output` (stderr if None), usable as a signal handler"""
+        text = self.format_summary()
+        if self.output is None:
+            sys.stderr.write(text + "\n")
+        else:
+            with open(self.output, "w") as f:
+                f.write(text + "\n")
+
+    def install_signal(self, signum = signal.SIGUSR1):
+        signal.signal(signum, self.dump)
+
+
+class InstrumentedApp(App):
+    """
+    `App` timing every stage of every key into `instrument`
+
+    >>> from test_config import config
+    >>> from app_fsa import AppFSA
+    >>> from session import AnnotationSession
+    >>> from state_manager import StateManager
+    >>> from display import Display
+    >>> from fake_screen import (FakeScreen, fake_curses)
+    >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+    >>> sm = StateManager(session, config["labels"].keys())
+    >>> screen = FakeScreen(keys = [ord('j'), -1, ord('l'), ord('x')]) # -1: getch interrupted by a signal
+    >>> instrument = Instrument()
+    >>> app = InstrumentedApp(screen, AppFSA.from_config(config), sm,
+    ...                       Display(screen, config, curses_lib = fake_curses), instrument)
+    >>> for _ in range(4):
+    ...     op = app.handle_key(app.read_key())
+    >>> ops = instrument.summary()["ops"]
+    >>> sorted(ops), sorted(ops["CursorLeft"])
+    (['CursorLeft', 'CursorRight', 'None'], ['display_data', 'fsa', 'receive', 'render', 'total'])
+    >>> instrument.keys, instrument.summary()["getch_wait"]["count"]
+    (3, 3)
+    >>> sm.close()
+    >>> import os
+    >>> os.remove("data/test_data/session.pkl")
+    """
+    def __init__(self, screen, fsa, sm, display, instrument, recorder = None, max_fps = 60):
+        App.__init__(self, screen, fsa, sm, display, recorder, max_fps)
+        self.instrument = instrument
+        # seconds of every stage of the key being handled, None between keys
+        self.stage_times = None
+        self.render_time = 0.0
+
+    def read_key(self):
+        if not self.blocking: # draining keys already there
+            return App.read_key(self)
+        start = timer()
+        c = App.read_key(self)
+        if c != -1: # an interrupted wait is no key
+            self.instrument.wait.record(int((timer() - start) * 1000000))
+        return c
+
+    def transition(self, c):
+        start = timer()
+        operation = App.transition(self, c)
+        self.stage_times["fsa"] = timer() - start
+        return operation
+
+    def apply(self, operation):
+        start = timer()
+        App.apply(self, operation)
+        self.stage_times["receive"] = timer() - start
+
+    def render(self, data):
+        start = timer()
+        App.render(self, data)
+        self.render_time = timer() - start
+
+    def flush(self):
+        """frames drawn for a batch of keys are timed as the "Frame" op, for a key alone as its op"""
+        if not self.dirty:
+            return
+        start = timer()
+        App.flush(self)
+        total = timer() - start
+        if self.stage_times is not None:
+            self.stage_times["display_data"] = total - self.render_time
+            self.stage_times["render"] = self.render_time
+        else:
+            record = self.instrument.record
+            record("Frame", "display_data", total - self.render_time)
+            record("Frame", "render", self.render_time)
+            record("Frame", "total", total)
+
+    def handle_key(self, c, render = True):
+        if c == -1:
+            return None
+        instrument = self.instrument
+        instrument.keys += 1
+        profiler = None
+        if instrument.profiler is not None and instrument.keys % instrument.profile_every == 0:
+            profiler = instrument.profiler
+            profiler.enable()
+        self.stage_times = {}
+        start = timer()
+        try:
+            operation = App.handle_key(self, c, render)
+        finally:
+            end = timer()
+            if profiler is not None:
+                profiler.disable()
+            stage_times, self.stage_times = self.stage_times, None
+
+        record = instrument.record
+        if c == curses.KEY_RESIZE:
+            record("Resize", "total", end - start)
+        elif operation is None:
+            record("None", "fsa", stage_times["fsa"])
+        else:
+            name = operation.__class__.__name__
+            for stage in STAGES:
+                if stage in stage_times:
+                    record(name, stage, stage_times[stage])
+            record(name, "total", end - start)
+        return operation
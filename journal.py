@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Crash-safe checkpoint journal for annotation sessions
+"""
+import os
+import time
+import zlib
+import struct
+try:
+    from cPickle import (loads, dumps)
+except ImportError:
+    from pickle import (loads, dumps)
+
+MAGIC = "CSQJ\x00\x00\x00\x01"
+HEADER_LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<QqqI") # seq, sent_id, offset, crc32
+RECORD_BODY = struct.Struct("<Qqq")
+
+NO_OFFSET = -1
+
+
+class JournalError(Exception):
+    pass
+
+
+def _pack(seq, sent_id, offset):
+    if offset is None:
+        offset = NO_OFFSET
+    body = RECORD_BODY.pack(seq, sent_id, offset)
+    return body + struct.pack("<I", zlib.crc32(body) & 0xffffffff)
+
+
+def fsync_dir(path):
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SessionJournal(object):
+    """
+    A session file made of a header (the session data, pickled) followed by
+    fixed-size checkpoint records of (sent_id, offset)
+
+    Checkpoints are appended with group commit: the file is fsync'ed once
+    `sync_every` records are pending or `sync_interval` seconds have passed
+    since the last sync. Every `compact_every` records the file is rewritten
+    atomically to the header and the latest checkpoint. On recovery the
+    records after the last valid one (a torn write) are dropped.
+
+    >>> j = SessionJournal("data/test_data/journal.test", sync_every = 2)
+    >>> j.exists()
+    False
+    >>> j.rewrite({"current_sent_id": -1, "current_offset": 0, "output_dir": "out"})
+    >>> j.append(0, 0); j.pending
+    1
+    >>> j.append(1, 6); j.pending
+    0
+    >>> j.close()
+    >>> with open("data/test_data/journal.test", "ab") as f:
+    ...     f.write("torn")
+    >>> header, checkpoint = SessionJournal("data/test_data/journal.test").recover()
+    >>> header["output_dir"], checkpoint
+    ('out', (1, 6))
+    >>> os.remove("data/test_data/journal.test")
+    """
+
+    def __init__(self, path, sync_every = 8, sync_interval = 1.0, compact_every = 4096):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+
+        self.fd = None
+        self.seq = 0
+        self.records = 0
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def recover(self):
+        """
+        Return (header, checkpoint) where checkpoint is the last valid
+        (sent_id, offset) record, or None if there is none
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        if not data.startswith(MAGIC): # plain pickled session data
+            header = loads(data)
+            return header, (header["current_sent_id"], header.get("current_offset"))
+
+        pos = len(MAGIC)
+        if len(data) < pos + HEADER_LENGTH.size:
+            raise JournalError("Truncated session header in '%s'" %(self.path))
+        header_length, = HEADER_LENGTH.unpack_from(data, pos)
+        pos += HEADER_LENGTH.size
+        header = loads(data[pos: pos + header_length])
+        pos += header_length
+
+        checkpoint = None
+        self.records = 0
+        while pos + RECORD.size <= len(data):
+            seq, sent_id, offset, crc = RECORD.unpack_from(data, pos)
+            body = data[pos: pos + RECORD_BODY.size]
+            if crc != zlib.crc32(body) & 0xffffffff:
+                break
+            if checkpoint is not None and seq != self.seq + 1:
+                break
+            self.seq = seq
+            self.records += 1
+            checkpoint = (sent_id, None if offset == NO_OFFSET else offset)
+            pos += RECORD.size
+
+        return header, checkpoint
+
+    def rewrite(self, header):
+        """
+        Atomically replace the file with `header` and a single checkpoint
+        made of its current_sent_id and current_offset
+        """
+        self.close()
+
+        self.seq += 1
+        header_data = dumps(header, 2)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header_data)))
+            f.write(header_data)
+            f.write(_pack(self.seq, header["current_sent_id"], header.get("current_offset")))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        fsync_dir(self.path)
+
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.records = 1
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def append(self, sent_id, offset):
+        if self.fd is None:
+            raise JournalError("Journal '%s' is not open" %(self.path))
+        self.seq += 1
+        os.write(self.fd, _pack(self.seq, sent_id, offset))
+        self.records += 1
+        self.pending += 1
+
+        if self.pending >= self.sync_every or \
+           (self.sync_interval is not None and time.time() - self.last_sync >= self.sync_interval):
+            self.sync()
+
+    def needs_compaction(self):
+        return self.records >= self.compact_every
+
+    def sync(self):
+        if self.fd is not None and self.pending > 0:
+            os.fsync(self.fd)
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,45 @@
+class LabelVocab(object):
+    """
+    Interned label names, so that labels can be stored as small integers
+
+    Id 0 stands for "no label"
+
+    >>> from test_config import config
+    >>> vocab = LabelVocab.from_config(config)
+    >>> vocab.id("object"), vocab.name(vocab.id("product"))
+    (4, 'product')
+    >>> vocab.intern("other")
+    5
+    >>> vocab.name(LabelVocab.NO_LABEL) is None
+    True
+    """
+    NO_LABEL = 0
+
+    def __init__(self, names = ()):
+        self.names = [None]
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(l['name']
+                   for group in sorted(config["labels"])
+                   for l in config["labels"][group])
+
+    def intern(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            label_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            return label_id
+
+    def id(self, name):
+        return self.ids[name]
+
+    def name(self, label_id):
+        return self.names[label_id]
+
+    def __len__(self):
+        return len(self.names) - 1
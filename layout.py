@@ -0,0 +1,86 @@
+from array import array
+from bisect import bisect_right
+
+class WrapLayout(object):
+    """
+    Where every word goes when a sentence is wrapped to the screen width,
+    as (row, column) with rows counted in lines of words
+
+    >>> layout = WrapLayout([1, 4, 2, 3], max_col = 10, word_spacing = 2)
+    >>> [layout.position(i) for i in range(4)]
+    [(0, 0), (0, 3), (1, 0), (1, 4)]
+    >>> layout.row_count
+    2
+    >>> layout.words_in_rows(1, 2)
+    [2, 3]
+    >>> layout.nearest_in_row(1, 3), layout.nearest_in_row(0, 9), layout.nearest_in_row(2, 0)
+    (3, 1, None)
+    """
+    def __init__(self, widths, max_col, word_spacing):
+        self.widths = widths
+        self.max_col = max_col
+        self.word_spacing = word_spacing
+
+        self.rows = array("l")
+        self.cols = array("l")
+        self.row_starts = array("l") # index of the first word of every row
+
+        row = 0
+        x = 0
+        for i, width in enumerate(widths):
+            if i == 0:
+                self.row_starts.append(0)
+            elif x + width + word_spacing > max_col:
+                row += 1
+                x = 0
+                self.row_starts.append(i)
+            self.rows.append(row)
+            self.cols.append(x)
+            x += width + word_spacing
+
+    @property
+    def row_count(self):
+        return len(self.row_starts)
+
+    def position(self, index):
+        return self.rows[index], self.cols[index]
+
+    def row_of(self, index):
+        return self.rows[index]
+
+    def words_in_rows(self, first_row, last_row):
+        """indices of the words in rows first_row, ..., last_row - 1"""
+        last_row = min(last_row, self.row_count)
+        if first_row >= last_row:
+            return []
+        start = self.row_starts[first_row]
+        if last_row < self.row_count:
+            end = self.row_starts[last_row]
+        else:
+            end = len(self.widths)
+        return range(start, end)
+
+    def row_range(self, row):
+        """indices [start, end) of the words in `row`"""
+        start = self.row_starts[row]
+        if row + 1 < self.row_count:
+            return start, self.row_starts[row + 1]
+        return start, len(self.widths)
+
+    def nearest_in_row(self, row, col):
+        """the word of `row` closest to column `col`, None if there is no such row"""
+        if not 0 <= row < self.row_count:
+            return None
+        start, end = self.row_range(row)
+        i = bisect_right(self.cols, col, start, end) - 1
+        if i < start:
+            return start
+        if col < self.cols[i] + self.widths[i] or i + 1 == end:
+            return i
+        # in the space after word i
+        if col - (self.cols[i] + self.widths[i] - 1) <= self.cols[i + 1] - col:
+            return i
+        return i + 1
+
+    def __len__(self):
+        return len(self.widths)
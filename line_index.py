@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Sidecar line-offset index for sentence files
+"""
+import os
+from array import array
+try:
+    from cPickle import (load, dump)
+except ImportError:
+    from pickle import (load, dump)
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+
+def file_fingerprint(path):
+    """(size, mtime) of the file, used to tell whether it has changed"""
+    st = os.stat(path)
+    return (st.st_size, int(st.st_mtime))
+
+
+class StaleIndexError(Exception):
+    pass
+
+
+class LineIndex(object):
+    """
+    Byte offset of the beginning of every line in a file
+
+    >>> idx = LineIndex.build("data/test_data/sents.txt")
+    >>> len(idx)
+    2
+    >>> idx.offset(0), idx.offset(1)
+    (0, 6)
+    >>> idx.is_fresh("data/test_data/sents.txt")
+    True
+    >>> idx.save("data/test_data/sents.txt.idx")
+    >>> LineIndex.load("data/test_data/sents.txt.idx").offset(1)
+    6
+    >>> os.remove("data/test_data/sents.txt.idx")
+    """
+
+    def __init__(self, offsets, fingerprint):
+        self.offsets = offsets
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, path, chunk_size = 1 << 20):
+        """build the index in one streaming pass over `path`"""
+        fingerprint = file_fingerprint(path)
+        offsets = array("L")
+        with open(path, "rb") as f:
+            pos = 0
+            line_start = True
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                if line_start:
+                    offsets.append(pos)
+                i = chunk.find("\n")
+                while i != -1:
+                    if i + 1 < len(chunk):
+                        offsets.append(pos + i + 1)
+                    i = chunk.find("\n", i + 1)
+                line_start = chunk.endswith("\n")
+                pos += len(chunk)
+        return cls(offsets, fingerprint)
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, "rb") as f:
+            header = load(f)
+            if header.get("version") != INDEX_VERSION:
+                raise StaleIndexError("Unknown index version in '%s'" %(index_path))
+            offsets = array("L")
+            offsets.fromfile(f, header["count"])
+        return cls(offsets, header["fingerprint"])
+
+    @classmethod
+    def for_file(cls, path, index_path = None):
+        """
+        Load the sidecar index of `path`, (re)building it if
+        it is missing or the file has changed since it was built
+        """
+        if index_path is None:
+            index_path = path + INDEX_SUFFIX
+
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+            except (StaleIndexError, EOFError, ValueError):
+                index = None
+            if index is not None and index.is_fresh(path):
+                return index
+
+        index = cls.build(path)
+        try:
+            index.save(index_path)
+        except (IOError, OSError): # e.g. a read-only corpus directory, the index is rebuilt next time
+            pass
+        return index
+
+    def save(self, index_path):
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            dump({"version": INDEX_VERSION,
+                  "fingerprint": self.fingerprint,
+                  "count": len(self.offsets)}, f, 2)
+            self.offsets.tofile(f)
+        os.rename(tmp_path, index_path)
+
+    def is_fresh(self, path):
+        return file_fingerprint(path) == tuple(self.fingerprint)
+
+    def offset(self, line_no):
+        return int(self.offsets[line_no])
+
+    def __len__(self):
+        return len(self.offsets)
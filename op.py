@@ -45,3 +45,32 @@ class ConfirmSentence(Op):
 
 class SetMark(Op):
     pass
+
+class Undo(Op):
+    pass
+
+class Redo(Op):
+    pass
+
+#####################
+## Navigation
+#####################
+class NavigationOp(Op):
+    pass
+
+class PrevSentence(NavigationOp):
+    pass
+
+class NextSentence(NavigationOp):
+    pass
+
+class GotoSentence(NavigationOp):
+    """`sent_id` None: to be asked for"""
+    def __init__(self, sent_id = None):
+        self.sent_id = sent_id
+
+    def __str__(self):
+        return "GotoSentence(%s)" %(self.sent_id)
+
+    def __repr__(self):
+        return str(self)
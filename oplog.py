@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Log of the operations applied to the sentence in progress
+"""
+import os
+import time
+import zlib
+import struct
+
+from op import (Label, CancelLabel, SetMark, Undo, Redo)
+
+# record: crc32 and length of the body, then the body
+RECORD_HEAD = struct.Struct("<IH")
+# body: kind, cursor index, selection on, selection anchor, selection offset
+STATE = struct.Struct("<BiBii")
+SENT_ID = struct.Struct("<q")
+STRING_LENGTH = struct.Struct("<H")
+
+BEGIN, LABEL, CANCEL_LABEL, SET_MARK, UNDO, REDO = range(6)
+KINDS = {CancelLabel: CANCEL_LABEL, SetMark: SET_MARK, Undo: UNDO, Redo: REDO, Label: LABEL}
+OPS = dict((kind, op_class) for op_class, kind in KINDS.items())
+
+NO_ANCHOR = -1
+
+
+class OpLogError(Exception):
+    pass
+
+
+def _string(s):
+    data = s.encode("utf8")
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def _read_string(body, pos):
+    length, = STRING_LENGTH.unpack_from(body, pos)
+    pos += STRING_LENGTH.size
+    return body[pos: pos + length].decode("utf8"), pos + length
+
+
+class OpLog(object):
+    """
+    The operations of the sentence in progress, each with the cursor and
+    selection state it was applied in, so that replaying them restores
+    the sentence as it was
+
+    The log starts with the id of the sentence and is truncated when
+    the next one begins. Records are checksummed, a torn last record
+    is dropped on recovery, and syncing is grouped like the session journal
+
+    >>> log = OpLog("data/test_data/ops.test")
+    >>> log.begin(3)
+    >>> log.append(SetMark(), (0, False, None, None))
+    >>> log.append(Label(u"role", u"subject"), (1, True, 0, 1))
+    >>> log.close()
+    >>> with open("data/test_data/ops.test", "ab") as f:
+    ...     f.write("torn")
+    >>> log = OpLog("data/test_data/ops.test")
+    >>> sent_id, records = log.recover()
+    >>> sent_id, [(op.__class__.__name__, state) for op, state in records]
+    (3, [('SetMark', (0, False, None, None)), ('Label', (1, True, 0, 1))])
+    >>> records[1][0]
+    Label(role, subject)
+    >>> log.resume(); log.append(Undo(), (1, False, None, None)); log.close()
+    >>> [op.__class__.__name__ for op, state in OpLog("data/test_data/ops.test").recover()[1]]
+    ['SetMark', 'Label', 'Undo']
+    >>> log = OpLog("data/test_data/ops.test"); log.end(); log.close()
+    >>> log.append(SetMark(), (0, True, 0, 0)) # closed: not logged
+    >>> OpLog("data/test_data/ops.test").recover()
+    (None, [])
+    >>> os.remove("data/test_data/ops.test")
+    """
+    def __init__(self, path, sync_every = 8, sync_interval = 1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.fd = None
+        # nothing is logged once closed, e.g. past the last sentence
+        self.closed = False
+        self.valid_length = 0
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def _open(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+
+    def _write(self, body):
+        os.write(self.fd, RECORD_HEAD.pack(zlib.crc32(body) & 0xffffffff, len(body)) + body)
+        self.pending += 1
+        if self.pending >= self.sync_every or \
+           (self.sync_interval is not None and time.time() - self.last_sync >= self.sync_interval):
+            self.sync()
+
+    def recover(self):
+        """(sentence id, [(op, state)]) of the log, (None, []) if there is none"""
+        self.valid_length = 0
+        if not os.path.exists(self.path):
+            return None, []
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        sent_id = None
+        records = []
+        pos = 0
+        while pos + RECORD_HEAD.size <= len(data):
+            crc, length = RECORD_HEAD.unpack_from(data, pos)
+            body = data[pos + RECORD_HEAD.size: pos + RECORD_HEAD.size + length]
+            if len(body) < length or crc != zlib.crc32(body) & 0xffffffff:
+                break
+            pos += RECORD_HEAD.size + length
+            if sent_id is None:
+                if ord(body[0]) != BEGIN:
+                    break
+                sent_id, = SENT_ID.unpack_from(body, 1)
+            else:
+                records.append(self.decode(body))
+            self.valid_length = pos
+        return sent_id, records
+
+    def decode(self, body):
+        kind, index, select_on, anchor, offset = STATE.unpack_from(body)
+        if kind == LABEL:
+            group, pos = _read_string(body, STATE.size)
+            name, pos = _read_string(body, pos)
+            op = Label(group, name)
+        else:
+            op = OPS[kind]()
+        if anchor == NO_ANCHOR:
+            anchor, offset = None, None
+        return op, (index, bool(select_on), anchor, offset)
+
+    def encode(self, op, state):
+        index, select_on, anchor, offset = state
+        if anchor is None:
+            anchor, offset = NO_ANCHOR, 0
+        try:
+            kind = KINDS[op.__class__]
+        except KeyError:
+            raise OpLogError("%r is not logged" %(op))
+        body = STATE.pack(kind, index, select_on, anchor, offset)
+        if kind == LABEL:
+            body += _string(unicode(op.group)) + _string(unicode(op.name))
+        return body
+
+    def begin(self, sent_id):
+        """Start the log of sentence `sent_id`, dropping the previous one"""
+        if self.closed:
+            return
+        self._open()
+        os.ftruncate(self.fd, 0)
+        self._write(chr(BEGIN) + SENT_ID.pack(sent_id))
+        self.sync()
+
+    def resume(self):
+        """Go on with the recovered log, without its torn tail if any"""
+        self._open()
+        os.ftruncate(self.fd, self.valid_length)
+
+    def end(self):
+        """Drop the log, no sentence being in progress"""
+        self._open()
+        os.ftruncate(self.fd, 0)
+        self.pending = 0
+
+    def append(self, op, state):
+        if self.closed:
+            return
+        self._write(self.encode(op, state))
+
+    def sync(self):
+        if self.fd is not None and self.pending > 0:
+            os.fsync(self.fd)
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        self.closed = True
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Reading and tokenizing the upcoming sentences ahead of time
+"""
+import sys
+import Queue
+import threading
+
+from sent import Sentence
+from session import SessionError
+
+END_OF_INPUT = "end"
+WORKER_ERROR = "error"
+
+
+class SentencePrefetcher(object):
+    """
+    Keeps up to `depth` tokenized sentences of `session` ready in a worker thread
+
+    The session only moves forward (and checkpoints) when a sentence is
+    taken with `next_sentence`, so resuming is not affected by what has
+    been prefetched.
+
+    >>> from session import AnnotationSession
+    >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+    >>> prefetcher = SentencePrefetcher(session, depth = 1)
+    >>> prefetcher.next_sentence()
+    [u'a', u'b', u'c']
+    >>> session.current_sent_id
+    0
+    >>> prefetcher.next_sentence()
+    [u'd', u'e', u'f']
+    >>> prefetcher.next_sentence() # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    IOError: No more to read from 'data/test_data/sents.txt'
+    >>> prefetcher.close()
+    >>> import os
+    >>> os.remove("data/test_data/session.pkl")
+    """
+
+    def __init__(self, session, depth = 16, tokenize = Sentence.from_unicode):
+        self.session = session
+        self.tokenize = tokenize
+
+        self.queue = Queue.Queue(maxsize = depth)
+        self.stopped = threading.Event()
+        self.finished = None
+
+        self.thread = threading.Thread(target = self._run, name = "sentence-prefetch")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                offset, line = self.session.read_sentence()
+            except IOError:
+                self._put((END_OF_INPUT, sys.exc_info()))
+                return
+            except Exception:
+                self._put((WORKER_ERROR, sys.exc_info()))
+                return
+
+            if isinstance(line, Sentence): # from the token cache
+                self._put((offset, line))
+                continue
+            try:
+                sent = self.tokenize(line)
+            except Exception:
+                self._put((WORKER_ERROR, sys.exc_info()))
+                return
+            self._put((offset, sent))
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def _get(self):
+        while True:
+            try:
+                return self.queue.get(timeout = 0.1)
+            except Queue.Empty:
+                if not self.thread.is_alive() and self.queue.empty():
+                    raise SessionError("Prefetch worker is not running")
+
+    def next_sentence(self):
+        """The next tokenized sentence, which becomes the session's current one"""
+        if not self.session.active:
+            raise SessionError("Session is not active")
+
+        if self.finished is None:
+            offset, item = self._get()
+            if offset in (END_OF_INPUT, WORKER_ERROR):
+                self.finished = item
+            else:
+                self.session.begin_sentence(offset)
+                return item
+
+        exc_type, exc_value, tb = self.finished
+        raise exc_type, exc_value, tb
+
+    def close(self):
+        self.stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                break
+        self.thread.join()
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Index of the confirmed annotations, to query label statistics without reading the outputs
+
+    python query_index.py rebuild INDEX OUTPUT_DIR [--input-format files|conll|jsonl]
+    python query_index.py count INDEX [GROUP [NAME]]
+    python query_index.py sentences INDEX GROUP NAME [--limit N]
+
+The app keeps the index up to date as sentences are confirmed (--query-index),
+`rebuild` creates it for an existing output directory
+"""
+import sqlite3
+import argparse
+from itertools import groupby
+from collections import Counter
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+from store import open_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    sent_id INTEGER NOT NULL,
+    grp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS spans_sent ON spans (sent_id);
+CREATE INDEX IF NOT EXISTS spans_label ON spans (grp, name, sent_id);
+CREATE TABLE IF NOT EXISTS counts (
+    grp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    spans INTEGER NOT NULL,
+    sentences INTEGER NOT NULL,
+    PRIMARY KEY (grp, name));
+"""
+
+
+def spans_of_rows(rows, groups, missing = u"-"):
+    """
+    Spans (start, end, group, name) of saved annotation rows, runs of a label making one span
+
+    >>> spans_of_rows([(u'a', u'PER', u'-'), (u'b', u'PER', u'VB'), (u'c', u'-', u'-')], ["ner", "pos"])
+    [(0, 1, 'ner', u'PER'), (1, 1, 'pos', u'VB')]
+    """
+    spans = []
+    for column, group in enumerate(groups, 1):
+        start = 0
+        for name, run in groupby(row[column] for row in rows):
+            end = start + len(list(run)) - 1
+            if name != missing:
+                spans.append((start, end, group, name))
+            start = end + 1
+    return sorted(spans)
+
+
+class QueryIndex(object):
+    """
+    A SQLite index of the labeled spans of every confirmed sentence,
+    with the number of spans and of sentences of every label kept up
+    to date, so that counts are a lookup and the sentences with a label
+    a range of the (group, name, sentence id) index
+
+    Confirming a sentence again replaces its spans
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> index = QueryIndex(d + "/index.db")
+    >>> index.update(0, [(0, 1, "role", "subject"), (3, 3, "role", "subject")])
+    >>> index.update(1, [(2, 2, "role", "object"), (0, 0, "role", "subject")])
+    >>> index.count("role", "subject"), index.sentences("role", "subject")
+    ([(u'role', u'subject', 3, 2)], [0, 1])
+    >>> index.update(0, [(0, 0, "is_product", "product")])
+    >>> index.count()
+    [(u'is_product', u'product', 1, 1), (u'role', u'object', 1, 1), (u'role', u'subject', 1, 1)]
+    >>> index.spans(0)
+    [(0, 0, u'is_product', u'product')]
+    >>> index.close()
+    >>> shutil.rmtree(d)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout = 60, isolation_level = None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        c = self.conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except:
+            c.execute("ROLLBACK")
+            raise
+        else:
+            c.execute("COMMIT")
+
+    def _add_counts(self, c, labels, sign):
+        for (group, name), span_count in Counter(labels).iteritems():
+            c.execute("INSERT OR IGNORE INTO counts VALUES (?, ?, 0, 0)", (group, name))
+            c.execute("UPDATE counts SET spans = spans + ?, sentences = sentences + ? "
+                      "WHERE grp = ? AND name = ?", (sign * span_count, sign, group, name))
+
+    def _replace(self, c, sent_id, spans):
+        old_labels = c.execute("SELECT grp, name FROM spans WHERE sent_id = ?", (sent_id, )).fetchall()
+        self._add_counts(c, old_labels, -1)
+        c.execute("DELETE FROM spans WHERE sent_id = ?", (sent_id, ))
+        c.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?)",
+                      [(sent_id, group, name, start, end) for start, end, group, name in spans])
+        self._add_counts(c, [(group, name) for start, end, group, name in spans], 1)
+
+    def update(self, sent_id, spans):
+        """Make `spans` (start, end, group, name) the ones of sentence `sent_id`"""
+        with self._transaction() as c:
+            self._replace(c, sent_id, spans)
+
+    def update_many(self, sentences):
+        """update() for every (sent_id, spans) of `sentences`, in one transaction"""
+        with self._transaction() as c:
+            for sent_id, spans in sentences:
+                self._replace(c, sent_id, spans)
+
+    def insert_many(self, sentences):
+        """Add the (sent_id, spans) of sentences not in the index yet, in one transaction"""
+        labels = Counter()
+        sentence_labels = Counter()
+        rows = []
+        for sent_id, spans in sentences:
+            rows.extend((sent_id, group, name, start, end) for start, end, group, name in spans)
+            sent_labels = set()
+            for start, end, group, name in spans:
+                labels[group, name] += 1
+                sent_labels.add((group, name))
+            sentence_labels.update(sent_labels)
+        with self._transaction() as c:
+            c.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?)", rows)
+            for (group, name), span_count in labels.iteritems():
+                c.execute("INSERT OR IGNORE INTO counts VALUES (?, ?, 0, 0)", (group, name))
+                c.execute("UPDATE counts SET spans = spans + ?, sentences = sentences + ? "
+                          "WHERE grp = ? AND name = ?", 
+                          (span_count, sentence_labels[group, name], group, name))
+
+    def clear(self):
+        with self._transaction() as c:
+            c.execute("DELETE FROM spans")
+            c.execute("DELETE FROM counts")
+
+    def count(self, group = None, name = None):
+        """(group, name, spans, sentences) of every label, or those of `group` or of `name` in it"""
+        query = "SELECT grp, name, spans, sentences FROM counts WHERE spans > 0"
+        params = ()
+        if group is not None:
+            query += " AND grp = ?"
+            params += (group, )
+            if name is not None:
+                query += " AND name = ?"
+                params += (name, )
+        return self.conn.execute(query + " ORDER BY grp, name", params).fetchall()
+
+    def sentences(self, group, name, limit = None):
+        """Ids of the sentences with a span labeled `name` in `group`"""
+        query = "SELECT DISTINCT sent_id FROM spans WHERE grp = ? AND name = ? ORDER BY sent_id"
+        params = (group, name)
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit, )
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def spans(self, sent_id):
+        return sorted(self.conn.execute("SELECT start, end, grp, name FROM spans WHERE sent_id = ?",
+                                        (sent_id, )).fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+def rebuild(index_path, output_dir, groups, input_format = "files", batch_size = 1000):
+    """Index the sentences saved in `output_dir` from scratch, returning how many there are"""
+    store = open_store(output_dir, input_format)
+    index = QueryIndex(index_path)
+    try:
+        index.clear()
+        sent_ids = store.sent_ids()
+        for i in xrange(0, len(sent_ids), batch_size):
+            index.insert_many([(sent_id, spans_of_rows(store.read(sent_id), groups))
+                               for sent_id in sent_ids[i: i + batch_size]])
+        return len(sent_ids)
+    finally:
+        index.close()
+        store.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Label statistics of the confirmed annotations")
+    commands = parser.add_subparsers(dest = "command")
+
+    rebuild_parser = commands.add_parser("rebuild", help = "index an existing output directory")
+    rebuild_parser.add_argument("index")
+    rebuild_parser.add_argument("output_dir")
+    rebuild_parser.add_argument("--input-format", choices = ("files", "conll", "jsonl"), default = "files")
+
+    count_parser = commands.add_parser("count", help = "number of spans and sentences of every label")
+    count_parser.add_argument("index")
+    count_parser.add_argument("group", nargs = "?")
+    count_parser.add_argument("name", nargs = "?")
+
+    sentences_parser = commands.add_parser("sentences", help = "ids of the sentences with a label")
+    sentences_parser.add_argument("index")
+    sentences_parser.add_argument("group")
+    sentences_parser.add_argument("name")
+    sentences_parser.add_argument("--limit", type = int, default = None)
+
+    args = parser.parse_args(argv)
+
+    start = timer()
+    if args.command == "rebuild":
+        from config import config
+        count = rebuild(args.index, args.output_dir, config["labels"].keys(), args.input_format)
+        print "%d sentences indexed in %.1f s" %(count, timer() - start)
+        return
+
+    index = QueryIndex(args.index)
+    try:
+        if args.command == "count":
+            print "%-20s %-20s %10s %10s" %("group", "name", "spans", "sentences")
+            for group, name, spans, sentences in index.count(args.group, args.name):
+                print "%-20s %-20s %10d %10d" %(group, name, spans, sentences)
+        else:
+            for sent_id in index.sentences(args.group, args.name, args.limit):
+                print sent_id
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Recording keystrokes and replaying them headlessly for load testing
+
+    python replay.py keys.log --sentences PATH [--json]
+    python replay.py --synthetic 100000 --sentences PATH [--seed N] [--json]
+"""
+import os
+import json
+import random
+import shutil
+import tempfile
+import argparse
+from timeit import default_timer as timer
+
+from benchmark import median
+
+
+class KeyRecorder(object):
+    """
+    Logs every key code with the seconds elapsed since the recording started
+
+    >>> recorder = KeyRecorder("data/test_data/keys.log")
+    >>> recorder.record(ord('j')); recorder.record(ord('l'))
+    >>> recorder.close()
+    >>> [c for t, c in read_key_log("data/test_data/keys.log")]
+    [106, 108]
+    >>> os.remove("data/test_data/keys.log")
+    """
+    def __init__(self, path):
+        self.f = open(path, "w", 1) # line buffered, so that a crash loses nothing
+        self.start = timer()
+
+    def record(self, c):
+        self.f.write("%.6f\t%d\n" %(timer() - self.start, c))
+
+    def close(self):
+        self.f.close()
+
+
+def read_key_log(path):
+    """[(seconds, key code)] of a log written by `KeyRecorder`"""
+    keys = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                t, c = line.split("\t")
+                keys.append((float(t), int(c)))
+    return keys
+
+
+def config_keys(config):
+    """key codes bound in `config`, by operation name ("Label" for all labels)"""
+    def code(key):
+        return ord(key) if isinstance(key, basestring) else key
+
+    keys = {"Label": [code(l['key'])
+                      for group_labels in config["labels"].values()
+                      for l in group_labels]}
+    for name, key in config.items():
+        if name != "labels":
+            keys[name] = [code(key)]
+    return keys
+
+# how often each operation shows up in synthetic sessions
+SYNTHETIC_WEIGHTS = {
+    "CursorLeft": 30,
+    "CursorRight": 40,
+    "SetMark": 6,
+    "Label": 12,
+    "CancelLabel": 3,
+    "ConfirmSentence": 2,
+}
+
+def synthetic_keys(config, n, seed = 0, weights = SYNTHETIC_WEIGHTS):
+    """
+    `n` key codes imitating an annotator, drawn from the bindings in `config`
+
+    >>> from test_config import config
+    >>> keys = synthetic_keys(config, 1000)
+    >>> len(keys), ord('l') in keys, ord('i') in keys
+    (1000, True, False)
+    """
+    rng = random.Random(seed)
+    bound = config_keys(config)
+    choices = []
+    for name, weight in sorted(weights.items()):
+        choices += [bound[name]] * weight
+    return [rng.choice(rng.choice(choices)) for _ in xrange(n)]
+
+
+def replay(keys, config, sentence_path, rows = 40, cols = 120, prefetch_depth = 0, batch = 1):
+    """
+    Feed the key codes through the FSA, the state manager and the display
+    (on a fake screen) as fast as possible, with a throwaway session
+
+    With `batch` > 1 the keys arrive `batch` at a time, as with key repeat,
+    and one frame is drawn per batch (timed as the "Frame" op)
+
+    Returns a report of the throughput and of the latency of every operation
+    """
+    from app import App
+    from app_fsa import AppFSA
+    from session import AnnotationSession
+    from state_manager import StateManager
+    from display import Display
+    from label_vocab import LabelVocab
+    from fake_screen import (FakeScreen, fake_curses)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        session = AnnotationSession(os.path.join(work_dir, "session"), sentence_path, work_dir)
+        sm = StateManager(session, config["labels"].keys(), prefetch_depth = prefetch_depth,
+                          vocab = LabelVocab.from_config(config))
+        screen = FakeScreen(rows, cols)
+        display = Display(screen, config, curses_lib = fake_curses)
+        app = App(screen, AppFSA.from_config(config), sm, display)
+        display.display_sentence(sm.get_display_data())
+
+        latencies = {}
+        start = timer()
+        for i, c in enumerate(keys):
+            key_start = timer()
+            op = app.handle_key(c, render = batch <= 1)
+            elapsed = timer() - key_start
+            name = op.__class__.__name__ if op is not None else "None"
+            latencies.setdefault(name, []).append(elapsed)
+            if batch > 1 and (i + 1) % batch == 0:
+                frame_start = timer()
+                app.flush()
+                latencies.setdefault("Frame", []).append(timer() - frame_start)
+        total = timer() - start
+        sm.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    return report(latencies, total, len(keys))
+
+
+def report(latencies, total, key_count):
+    ops = sum(len(values) for name, values in latencies.items() if name not in ("None", "Frame"))
+    result = {"keys": key_count,
+              "ops": ops,
+              "seconds": total,
+              "keys_per_sec": key_count / total if total else 0.0,
+              "ops_per_sec": ops / total if total else 0.0,
+              "latency_ms": {}}
+    for name, values in latencies.items():
+        values = sorted(values)
+        result["latency_ms"][name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values) * 1000,
+            "p50": median(values) * 1000,
+            "p95": values[int(len(values) * 0.95)] * 1000,
+            "p99": values[int(len(values) * 0.99)] * 1000,
+            "max": values[-1] * 1000}
+    return result
+
+
+def format_report(result):
+    lines = ["%d keys, %d ops in %.2f s: %.0f keys/s, %.0f ops/s"
+             %(result["keys"], result["ops"], result["seconds"],
+               result["keys_per_sec"], result["ops_per_sec"]),
+             "",
+             "%-16s %8s %9s %9s %9s %9s %9s" %("op", "count", "mean", "p50", "p95", "p99", "max")]
+    for name, stats in sorted(result["latency_ms"].items()):
+        lines.append("%-16s %8d %9.3f %9.3f %9.3f %9.3f %9.3f"
+                     %(name, stats["count"], stats["mean"], stats["p50"],
+                       stats["p95"], stats["p99"], stats["max"]))
+    lines.append("(latencies in ms, op None: key that did not complete an operation)")
+    return "\n".join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Replay keystrokes headlessly and measure throughput")
+    parser.add_argument("log", nargs = "?", default = None,
+                        help = "key log written by app.py --record")
+    parser.add_argument("--synthetic", type = int, default = None, metavar = "N",
+                        help = "replay N generated keystrokes instead of a log")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--sentences", required = True)
+    parser.add_argument("--rows", type = int, default = 40)
+    parser.add_argument("--cols", type = int, default = 120)
+    parser.add_argument("--prefetch", type = int, default = 0)
+    parser.add_argument("--batch", type = int, default = 1,
+                        help = "keys applied per frame, as when keys are coalesced")
+    parser.add_argument("--json", action = "store_true")
+    args = parser.parse_args(argv)
+
+    from config import config
+    if args.synthetic is not None:
+        keys = synthetic_keys(config, args.synthetic, args.seed)
+    elif args.log is not None:
+        keys = [c for t, c in read_key_log(args.log)]
+    else:
+        parser.error("either a key log or --synthetic is needed")
+
+    result = replay(keys, config, args.sentences, args.rows, args.cols, args.prefetch, args.batch)
+    if args.json:
+        print json.dumps(result, indent = 2, sort_keys = True)
+    else:
+        print format_report(result)
+
+
+if __name__ == "__main__":
+    main()
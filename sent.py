@@ -1,30 +1,106 @@
 #!/usr/bin/python
 # coding=UTF-8
+from array import array
 
-import nltk
 from word import Word
+from label_vocab import LabelVocab
 
 class Sentence(list):
     u"""
-    
+    Tokens of a sentence along with one label column per label group
+
+    Label columns are arrays of ids in `vocab`, 0 being no label
+
     >>> s = Sentence.from_unicode(u"I love €.")
     >>> s
     [u'I', u'love', u'\\u20ac', u'.']
+    >>> s.set_label("role", 0, 1, "subject")
+    >>> s.columns["role"]
+    array('H', [1, 1, 0, 0])
+    >>> s.labels(1), s.labels(2)
+    ({'role': 'subject'}, {})
+    >>> s.row(0, ["role", "is_product"])
+    (u'I', u'subject', u'-')
+    >>> w = s.word(2)
+    >>> w.set_label("is_product", "product")
+    >>> s.label("is_product", 2)
+    'product'
     """
 
-    def __init__(self, words, **kwargs):
+    def __init__(self, words, vocab = None, text = None, **kwargs):
         self.words = words
+        self.text = text # the line it was tokenized from, if any
+        self.vocab = vocab if vocab is not None else LabelVocab()
+        self.columns = {}
         super(Sentence, self).__init__(words, **kwargs)
 
     @classmethod
     def from_unicode(cls, s):
-        words = [Word(w) 
-                 for w in nltk.word_tokenize(s)]
-
-        return Sentence(words)    
+        import nltk # heavy, so only loaded once the first sentence is tokenized
+        return Sentence(nltk.word_tokenize(s), text = s)
 
     def __getitem__(self, index):
         return self.words[index]
 
     def __repr__(self):
         return repr(self.words)
+
+    def word(self, index):
+        """`Word` view of the token at index"""
+        return Word(self.words[index], self, index)
+
+    def column(self, group):
+        try:
+            return self.columns[group]
+        except KeyError:
+            column = self.columns[group] = array("H", [LabelVocab.NO_LABEL]) * len(self.words)
+            return column
+
+    def use_vocab(self, vocab):
+        """Switch to `vocab`, translating the labels set so far"""
+        if vocab is self.vocab:
+            return
+        mapping = [LabelVocab.NO_LABEL] + [vocab.intern(name) for name in self.vocab.names[1:]]
+        for column in self.columns.values():
+            for i, label_id in enumerate(column):
+                column[i] = mapping[label_id]
+        self.vocab = vocab
+
+    def set_label(self, group, start, end, name):
+        """Label the tokens start...end (inclusive) as `name` in `group`"""
+        label_id = self.vocab.intern(name)
+        self.column(group)[start: end+1] = array("H", [label_id]) * (end + 1 - start)
+
+    def unset_label(self, group, start, end):
+        if group in self.columns:
+            self.columns[group][start: end+1] = array("H", [LabelVocab.NO_LABEL]) * (end + 1 - start)
+
+    def reset_label(self, start = 0, end = None):
+        if end is None:
+            end = len(self.words) - 1
+        for group in self.columns:
+            self.unset_label(group, start, end)
+
+    def label(self, group, index):
+        """label name of the token at index in group, or None"""
+        if group not in self.columns:
+            return None
+        return self.vocab.name(self.columns[group][index])
+
+    def labels(self, index):
+        names = self.vocab.names
+        return dict((group, names[column[index]]) 
+                    for group, column in self.columns.iteritems()
+                    if column[index] != LabelVocab.NO_LABEL)
+
+    def row(self, index, groups, missing = u"-"):
+        """(token, label of every group in `groups`) with `missing` for no label"""
+        names = self.vocab.names
+        item = [unicode(self.words[index])]
+        for group in groups:
+            column = self.columns.get(group)
+            if column is None or column[index] == LabelVocab.NO_LABEL:
+                item.append(missing)
+            else:
+                item.append(unicode(names[column[index]]))
+        return tuple(item)
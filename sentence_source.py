@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Random access to the sentences of a file
+"""
+import os
+import mmap
+
+from line_index import LineIndex
+
+
+class SentenceSource(object):
+    """
+    The lines of `path`, memory-mapped and looked up through its line
+    index, so that getting sentence i costs the same anywhere in the
+    file and only that line is decoded
+
+    >>> source = SentenceSource("data/test_data/sents.txt")
+    >>> len(source), source.get(1), source.offset(1)
+    (2, u'd e f', 6)
+    >>> source.get(2) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    IndexError: ...
+    >>> source.close()
+    >>> os.remove("data/test_data/sents.txt.idx")
+    """
+    def __init__(self, path, index = None):
+        self.path = path
+        self.index = index if index is not None else LineIndex.for_file(path)
+        self.size = os.path.getsize(path)
+        self.f = open(path, "rb")
+        if self.size > 0:
+            self.data = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+        else: # empty files can not be mapped
+            self.data = ""
+
+    def offset(self, i):
+        if not 0 <= i < len(self.index):
+            raise IndexError("No sentence %d in '%s'" %(i, self.path))
+        return self.index.offset(i)
+
+    def get(self, i):
+        start = self.offset(i)
+        if i + 1 < len(self.index):
+            end = self.index.offset(i + 1)
+        else:
+            end = self.size
+        return self.data[start: end].decode("utf8").strip()
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if self.size > 0:
+            self.data.close()
+        self.f.close()
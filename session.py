@@ -4,13 +4,13 @@
 Handling the task continuation/break etc.
 """
 import os
-try:
-    from cPickle import (load, dump)
-except ImportError:
-    from pickle import (load, dump)
 
-import codecs
-import tabulate
+from journal import SessionJournal
+from line_index import (LineIndex, file_fingerprint)
+from store import open_store
+from sentence_source import SentenceSource
+from compressed import (open_sentence_file, compression)
+from token_cache import TokenCache
 
 class SessionError(Exception):
     pass
@@ -61,65 +61,256 @@ class AnnotationSession(object):
     >>> os.remove("data/test_data/output/0.txt")
     >>> os.remove("data/test_data/output/1.txt")
 
+    >>> indexed = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output", use_index = True)
+    >>> indexed.next_sentence(); indexed.next_sentence()
+    u'a b c'
+    u'd e f'
+    >>> indexed.current_offset
+    6
+    >>> resumed = AnnotationSession("data/test_data/session.pkl", use_index = True)
+    >>> resumed.next_sentence()
+    u'd e f'
+    >>> os.remove("data/test_data/session.pkl")
+
     >>> s = AnnotationSession("data/test_data/session.pkl", "data/test_data/unicode_test_sents.txt", "data/test_data/output")
     >>> sent = s.next_sentence()
     >>> s.save_annotation([(u"€400", u'-'), (u"£302m", u"-")])
     >>> os.remove("data/test_data/session.pkl")
+
+    >>> s = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output", random_access = True)
+    >>> s.goto_sentence(1), s.current_sent_id
+    (u'd e f', 1)
+    >>> s.goto_sentence(0), s.next_sentence()
+    (u'a b c', u'd e f')
+    >>> s.goto_sentence(2) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    SessionError: ...
+    >>> s.goto_sentence(0); s.close()
+    u'a b c'
+    >>> AnnotationSession("data/test_data/session.pkl", random_access = True).next_sentence()
+    u'a b c'
+    >>> os.remove("data/test_data/session.pkl"); os.remove("data/test_data/sents.txt.idx")
+
+    >>> import tempfile, shutil, gzip
+    >>> d = tempfile.mkdtemp()
+    >>> with gzip.open(d + "/sents.txt.gz", "wb") as f:
+    ...     n = f.write(open("data/test_data/sents.txt").read())
+    >>> s = AnnotationSession(d + "/session.pkl", d + "/sents.txt.gz", d, random_access = True)
+    >>> s.next_sentence(), s.next_sentence(), s.sentence_count
+    (u'a b c', u'd e f', None)
+    >>> s.close()
+    >>> AnnotationSession(d + "/session.pkl").next_sentence()
+    u'd e f'
+    >>> shutil.rmtree(d)
+
+    >>> from token_cache import build
+    >>> d = tempfile.mkdtemp(); shutil.copy("data/test_data/sents.txt", d)
+    >>> build(d + "/sents.txt", processes = 1)
+    2
+    >>> s = AnnotationSession(d + "/session.pkl", d + "/sents.txt", d, token_cache = True)
+    >>> sent = s.next_sentence(); sent, sent.text
+    ([u'a', u'b', u'c'], u'a b c')
+    >>> s.close(); shutil.rmtree(d)
     """
-    def __init__(self, session_path, sentence_path = None, output_dir = None):
+    def __init__(self, session_path, sentence_path = None, output_dir = None, use_index = False, 
+                 output_format = "files", sync_every = 8, sync_interval = 1.0, random_access = False, 
+                 token_cache = False):
         self.active = True
+        self.use_index = use_index or random_access
+        self.journal = SessionJournal(session_path, sync_every, sync_interval)
         
-        if os.path.exists(session_path):
-            session_data = load(open(session_path))
+        if self.journal.exists():
+            session_data, checkpoint = self.journal.recover()
+            if checkpoint is not None:
+                session_data["current_sent_id"], session_data["current_offset"] = checkpoint
             self.current_sent_id = session_data["current_sent_id"]            
             self.output_dir = session_data["output_dir"]
             self.sentence_path = session_data["sentence_path"]
+            self.output_format = session_data.get("output_format", "files")
             
-            self.sent_file = codecs.open(self.sentence_path, "r", "utf8")
+            # where decompression can start, if the file has not changed
+            seek_points = None
+            fingerprint = session_data.get("sentence_fingerprint")
+            if fingerprint is not None and tuple(fingerprint) == file_fingerprint(self.sentence_path):
+                seek_points = session_data.get("seek_points")
+            self.sent_file = open_sentence_file(self.sentence_path, seek_points)
             
-            for i in xrange(self.current_sent_id):
-                self.sent_file.readline()
-
-            if self.current_sent_id >= 0:
-                self.current_sent_id -= 1 # to resume the process
+            self._seek_sentence(self.current_sent_id, 
+                                session_data.get("current_offset"), 
+                                session_data.get("sentence_fingerprint"))
         else:
             assert sentence_path is not None
             assert output_dir is not None
             
             self.output_dir = output_dir
             self.sentence_path = sentence_path
+            self.output_format = output_format
             self.current_sent_id = -1
 
-            self.sent_file = codecs.open(self.sentence_path, "r", "utf8")
+            self.sent_file = open_sentence_file(self.sentence_path)
 
+        self.sentence_fingerprint = file_fingerprint(self.sentence_path)
+        self.current_offset = self.sent_file.tell()
         self.session_path = session_path
 
+        # checkpoint of the sentence to resume, against the current file
+        self.saved_seek_points = len(getattr(self.sent_file, "seek_points", None) or ())
+        self.journal.rewrite(self.get_session_data())
+        if self.current_sent_id >= 0:
+            self.current_sent_id -= 1 # to resume the process
+
+        self.store = open_store(self.output_dir, self.output_format)
+
+        # id of the next sentence to read
+        self.read_id = self.current_sent_id + 1
+        if random_access and compression(self.sentence_path) is None:
+            # sentences are read from the mapped file, from sentence `read_id` on
+            self.source = SentenceSource(self.sentence_path)
+        else:
+            self.source = None
+
+        # sentences tokenized beforehand, if `token_cache` and there is a cache for this file
+        self.token_cache = TokenCache.for_file(self.sentence_path) if token_cache else None
+
+    def _seek_sentence(self, sent_id, offset, fingerprint):
+        """
+        Position the sentence file at the beginning of sentence `sent_id`
+
+        The persisted byte offset is used if the file is unchanged,
+        then the sidecar line index (if enabled) and finally line skipping
+
+        >>> s = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> s._seek_sentence(1, 3, file_fingerprint("data/test_data/sents.txt")) # not a line start
+        >>> s.sent_file.readline()
+        'd e f\\n'
+        >>> s.close(); os.remove("data/test_data/session.pkl")
+        """
+        if sent_id <= 0:
+            return
+        
+        if offset is not None and fingerprint is not None \
+           and tuple(fingerprint) == file_fingerprint(self.sentence_path) \
+           and self._is_line_start(offset):
+            self.sent_file.seek(offset)
+        elif self.use_index and compression(self.sentence_path) is None:
+            index = LineIndex.for_file(self.sentence_path)
+            if sent_id < len(index):
+                self.sent_file.seek(index.offset(sent_id))
+            else:
+                self.sent_file.seek(0, os.SEEK_END)
+        else:
+            self.sent_file.seek(0) # the offset check may have moved it
+            for i in xrange(sent_id):
+                self.sent_file.readline()
+
+    def _is_line_start(self, offset):
+        if offset == 0:
+            return True
+        self.sent_file.seek(offset - 1)
+        return self.sent_file.read(1) == "\n"
+
     def get_session_data(self, ):
         return {"current_sent_id": self.current_sent_id, 
+                "current_offset": self.current_offset, 
+                "sentence_fingerprint": self.sentence_fingerprint, 
                 "sentence_path": self.sentence_path, 
-                "output_dir": self.output_dir} 
+                "output_dir": self.output_dir, 
+                "output_format": self.output_format, 
+                "seek_points": getattr(self.sent_file, "seek_points", None)} 
             
     def next_sentence(self):
         if self.active:
-            line = self.sent_file.readline().strip()
-            if len(line) == 0:
-                raise IOError("No more to read from '%s'" %(self.sentence_path))
-            # save the state automatically
-            self.current_sent_id += 1
-            self._save_session()
-            
+            offset, line = self.read_sentence()
+            self.begin_sentence(offset)
             return line
         else:
             raise SessionError("Session is not active")
 
+    def read_sentence(self):
+        """
+        Read the next sentence without moving the session forward
+
+        Returns (offset, line), the line as a `Sentence` if the token cache has it
+        """
+        if self.source is not None:
+            if self.read_id >= len(self.source):
+                raise IOError("No more to read from '%s'" %(self.sentence_path))
+            offset, line = self.source.offset(self.read_id), self.source.get(self.read_id)
+            self.read_id += 1
+        else:
+            offset = self.sent_file.tell()
+            line = self.sent_file.readline().decode("utf8").strip()
+            self.read_id += 1
+        if len(line) == 0:
+            raise IOError("No more to read from '%s'" %(self.sentence_path))
+        if self.token_cache is not None:
+            sent = self.token_cache.sentence(self.read_id - 1, line)
+            if sent is not None:
+                return offset, sent
+        return offset, line
+
+    @property
+    def sentence_count(self):
+        """number of sentences, known with random access only"""
+        if self.source is None:
+            return None
+        return len(self.source)
+
+    def goto_sentence(self, sent_id):
+        """
+        Make sentence `sent_id` the current one, returning it (random access only)
+
+        A blank line is not a sentence, the session stays where it was
+
+        >>> import tempfile, shutil
+        >>> d = tempfile.mkdtemp()
+        >>> with open(d + "/sents.txt", "w") as f:
+        ...     f.write("a b\\n\\nc d\\n")
+        >>> s = AnnotationSession(d + "/session.pkl", d + "/sents.txt", d, random_access = True)
+        >>> s.next_sentence()
+        u'a b'
+        >>> s.goto_sentence(1)
+        Traceback (most recent call last):
+        ...
+        SessionError: Sentence 1 is blank
+        >>> s.current_sent_id, s.goto_sentence(2), s.current_sent_id
+        (0, u'c d', 2)
+        >>> s.close(); shutil.rmtree(d)
+        """
+        if self.source is None:
+            raise SessionError("Going to a sentence needs random access")
+        if not 0 <= sent_id < len(self.source):
+            raise SessionError("No sentence %d, there are %d" %(sent_id, len(self.source)))
+        read_id, current_sent_id = self.read_id, self.current_sent_id
+        self.read_id = sent_id
+        self.current_sent_id = sent_id - 1
+        try:
+            return self.next_sentence()
+        except IOError:
+            self.read_id, self.current_sent_id = read_id, current_sent_id
+            raise SessionError("Sentence %d is blank" %(sent_id))
+
+    def begin_sentence(self, offset):
+        """Make the sentence read at `offset` the current one"""
+        self.current_sent_id += 1
+        self.current_offset = offset
+        # save the state automatically
+        self._save_session()
+
     def _save_session(self):
-        dump(self.get_session_data(), open(self.session_path, "w"))
+        # new seek points of a compressed file go in the header
+        seek_points = getattr(self.sent_file, "seek_points", None)
+        if self.journal.needs_compaction() or \
+           (seek_points is not None and len(seek_points) != self.saved_seek_points):
+            self.saved_seek_points = len(seek_points or ())
+            self.journal.rewrite(self.get_session_data())
+        else:
+            self.journal.append(self.current_sent_id, self.current_offset)
         
     def save_annotation(self, annotation):
         if self.active:
-            output_path = os.path.join(self.output_dir, "%d.txt" %(self.current_sent_id))
-            with codecs.open(output_path, "w", "utf8") as f:
-                f.write(tabulate.tabulate(annotation, tablefmt="plain"))
+            self.store.write(self.current_sent_id, annotation)
 
             self.annotated = True
         else:
@@ -127,3 +318,107 @@ class AnnotationSession(object):
             
     def close(self):
         self.active = False
+        self.journal.close()
+        self.store.close()
+        if self.source is not None:
+            self.source.close()
+        if self.token_cache is not None:
+            self.token_cache.close()
+
+
+class SharedSession(object):
+    u"""
+    A session over a corpus shared by several annotator processes
+
+    Sentences are claimed one at a time from the SQLite queue at
+    `queue_path` under the name `owner`, so that a restarted annotator
+    gets back the sentence it was working on. Only the "files" output
+    layout can be written by several processes at once: the segmented
+    ones go to a subdirectory per owner
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> ann = SharedSession(d + "/queue.db", "data/test_data/sents.txt", d, "ann")
+    >>> bob = SharedSession(d + "/queue.db", "data/test_data/sents.txt", d, "bob")
+    >>> ann.next_sentence(), bob.next_sentence()
+    (u'a b c', u'd e f')
+    >>> ann.current_sent_id, bob.current_sent_id
+    (0, 1)
+    >>> ann.close() # quits halfway
+    >>> ann = SharedSession(d + "/queue.db", "data/test_data/sents.txt", d, "ann")
+    >>> ann.next_sentence()
+    u'a b c'
+    >>> ann.save_annotation([('a', '-'), ('b', '-'), ('c', 'PER')])
+    >>> ann.next_sentence() # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    IOError: ...
+    >>> sorted(os.listdir(d))
+    ['0.txt', 'queue.db', 'queue.db-shm', 'queue.db-wal']
+    >>> ann.close(); bob.close()
+    >>> shutil.rmtree(d); os.remove("data/test_data/sents.txt.idx")
+    """
+    def __init__(self, queue_path, sentence_path, output_dir, owner, 
+                 lease_seconds = 600, output_format = "files", token_cache = False):
+        from work_queue import (ClaimQueue, LeaseKeeper)
+        if compression(sentence_path) is not None:
+            raise SessionError("Sentences are claimed by line offset, '%s' must be decompressed first" 
+                               %(sentence_path))
+        self.active = True
+        self.owner = owner
+        self.sentence_path = sentence_path
+        self.output_format = output_format
+        self.index = LineIndex.for_file(sentence_path)
+        corpus = "%s:%d:%d" %((os.path.abspath(sentence_path), ) + file_fingerprint(sentence_path))
+        self.queue = ClaimQueue(queue_path, len(self.index), lease_seconds, corpus)
+
+        self.sent_file = open(sentence_path, "rb")
+        self.token_cache = TokenCache.for_file(sentence_path) if token_cache else None
+        self.current_sent_id = None
+        self.current_offset = None
+
+        if output_format == "files":
+            self.output_dir = output_dir
+        else:
+            self.output_dir = os.path.join(output_dir, owner)
+        self.store = open_store(self.output_dir, output_format)
+
+        self.keeper = LeaseKeeper(queue_path, owner, lease_seconds)
+        self.keeper.start()
+
+    def next_sentence(self):
+        if not self.active:
+            raise SessionError("Session is not active")
+        while True:
+            sent_id = self.queue.claim(self.owner)
+            if sent_id is None:
+                raise IOError("No more sentences to claim in '%s'" %(self.sentence_path))
+            offset = self.index.offset(sent_id)
+            self.sent_file.seek(offset)
+            line = self.sent_file.readline().decode("utf8").strip()
+            if line:
+                self.current_sent_id = sent_id
+                self.current_offset = offset
+                if self.token_cache is not None:
+                    sent = self.token_cache.sentence(sent_id, line)
+                    if sent is not None:
+                        return sent
+                return line
+            self.queue.complete(self.owner, sent_id) # nothing to annotate
+
+    def save_annotation(self, annotation):
+        if not self.active:
+            raise SessionError("Session is not active")
+        self.store.write(self.current_sent_id, annotation)
+        if not self.queue.complete(self.owner, self.current_sent_id):
+            raise SessionError("The lease on sentence %d ran out and another annotator claimed it" 
+                               %(self.current_sent_id))
+
+    def close(self):
+        self.active = False
+        self.keeper.stop()
+        self.queue.close()
+        self.store.close()
+        self.sent_file.close()
+        if self.token_cache is not None:
+            self.token_cache.close()
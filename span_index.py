@@ -0,0 +1,129 @@
+from bisect import bisect_right
+
+OVERLAP_POLICIES = ("replace", "trim", "reject")
+
+class OverlapError(Exception):
+    pass
+
+class SpanIndex(object):
+    """
+    Labeled spans of one label group, kept sorted and non-overlapping
+    so that point and range lookups are binary searches
+
+    What happens to existing spans overlapping a new one depends on `policy`:
+    "replace" drops them, "trim" keeps their parts outside the new span and
+    "reject" refuses the new span
+
+    >>> index = SpanIndex()
+    >>> index.add(2, 4, "PER")
+    []
+    >>> index.add(6, 6, "ORG")
+    []
+    >>> index.find(3), index.find(5)
+    ((2, 4, 'PER'), None)
+    >>> index.add(4, 6, "LOC")
+    [(2, 4, 'PER'), (6, 6, 'ORG')]
+    >>> index.spans()
+    [(4, 6, 'LOC')]
+    >>> index = SpanIndex("trim")
+    >>> index.add(0, 9, "PER")
+    []
+    >>> index.add(3, 4, "LOC")
+    [(0, 9, 'PER')]
+    >>> index.spans()
+    [(0, 2, 'PER'), (3, 4, 'LOC'), (5, 9, 'PER')]
+    >>> index.remove_at(7)
+    (5, 9, 'PER')
+    >>> index = SpanIndex("reject")
+    >>> index.add(0, 1, "PER")
+    []
+    >>> index.add(1, 2, "LOC")
+    Traceback (most recent call last):
+    ...
+    OverlapError: Span (1, 2) overlaps (0, 1, 'PER')
+    """
+    def __init__(self, policy = "replace"):
+        if policy not in OVERLAP_POLICIES:
+            raise ValueError("Unknown overlap policy %r" %(policy))
+        self.policy = policy
+
+        self.starts = []
+        self.ends = []
+        self.names = []
+
+    def _position(self, index):
+        """position of the span containing index, or None"""
+        i = bisect_right(self.starts, index) - 1
+        if i >= 0 and self.ends[i] >= index:
+            return i
+        return None
+
+    def _overlapping(self, start, end):
+        """positions [lo, hi) of the spans overlapping start...end"""
+        lo = bisect_right(self.starts, start) - 1
+        if lo < 0 or self.ends[lo] < start:
+            lo += 1
+        hi = bisect_right(self.starts, end)
+        return lo, hi
+
+    def _span(self, i):
+        return (self.starts[i], self.ends[i], self.names[i])
+
+    def _insert(self, start, end, name):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.names.insert(i, name)
+
+    def find(self, index):
+        i = self._position(index)
+        if i is None:
+            return None
+        return self._span(i)
+
+    def overlapping(self, start, end):
+        lo, hi = self._overlapping(start, end)
+        return [self._span(i) for i in xrange(lo, hi)]
+
+    def add(self, start, end, name):
+        """
+        Add the span start...end (inclusive)
+
+        Returns the existing spans it displaced (dropped or trimmed)
+        """
+        lo, hi = self._overlapping(start, end)
+        displaced = [self._span(i) for i in xrange(lo, hi)]
+
+        if displaced and self.policy == "reject":
+            raise OverlapError("Span (%d, %d) overlaps %r" %(start, end, displaced[0]))
+
+        del self.starts[lo: hi]
+        del self.ends[lo: hi]
+        del self.names[lo: hi]
+
+        if self.policy == "trim":
+            for s, e, n in displaced:
+                if s < start:
+                    self._insert(s, start - 1, n)
+                if e > end:
+                    self._insert(end + 1, e, n)
+
+        self._insert(start, end, name)
+        return displaced
+
+    def remove_at(self, index):
+        """Remove the span containing index, returning it (or None)"""
+        i = self._position(index)
+        if i is None:
+            return None
+        span = self._span(i)
+        del self.starts[i]
+        del self.ends[i]
+        del self.names[i]
+        return span
+
+    def spans(self):
+        return zip(self.starts, self.ends, self.names)
+
+    def __len__(self):
+        return len(self.starts)
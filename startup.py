@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Startup profiling: per-module import cost and time to the first frame
+
+    python startup.py [--sentences PATH] [--json]
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import threading
+import __builtin__
+from timeit import default_timer as timer
+
+
+class ImportProfiler(object):
+    """
+    Times the modules imported while installed
+
+    For every module, the cumulative time includes the modules it imports
+    itself, while the self time does not. Imports are nested per thread,
+    the prefetching thread importing while the app starts
+
+    >>> profiler = ImportProfiler()
+    >>> profiler.install()
+    >>> import colorsys
+    >>> profiler.uninstall()
+    >>> "colorsys" in profiler.records
+    True
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.local = threading.local()
+        self.original_import = None
+
+    def install(self):
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        __builtin__.__import__ = self.original_import
+
+    def _import(self, name, globals = None, locals = None, fromlist = None, level = -1):
+        if name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = timer()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = timer() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            cumulative, self_time = self.records.get(name, (0.0, 0.0))
+            self.records[name] = (cumulative + elapsed, self_time + elapsed - children)
+
+    def report(self, limit = 25):
+        lines = ["%10s %10s  %s" %("cum (ms)", "self (ms)", "module")]
+        records = sorted(self.records.items(), key = lambda (name, times): -times[0])
+        for name, (cumulative, self_time) in records[:limit]:
+            lines.append("%10.1f %10.1f  %s" %(cumulative * 1000, self_time * 1000, name))
+        return "\n".join(lines)
+
+
+def first_frame(sentence_path, config, rows = 40, cols = 120, prefetch_depth = 16):
+    """
+    Set up the app the way `app.main` does and draw the first frame
+    on a fake screen, with a throwaway session
+
+    The first sentence comes from the token cache of the file if there
+    is one, else it is tokenized, which loads nltk
+
+    Returns the screen
+    """
+    from app_fsa import AppFSA
+    from session import AnnotationSession
+    from state_manager import StateManager
+    from display import Display
+    from fake_screen import (FakeScreen, fake_curses)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        AppFSA.from_config(config)
+        session = AnnotationSession(os.path.join(work_dir, "session"), sentence_path, work_dir, 
+                                    random_access = True, token_cache = True)
+        sm = StateManager(session, config["labels"].keys(), prefetch_depth = prefetch_depth)
+
+        screen = FakeScreen(rows, cols)
+        display = Display(screen, config, curses_lib = fake_curses)
+        display.display_sentence(sm.get_display_data())
+        sm.close()
+    finally:
+        shutil.rmtree(work_dir)
+    return screen
+
+
+def main(argv = None):
+    start = timer()
+    profiler = ImportProfiler()
+    profiler.install()
+
+    parser = argparse.ArgumentParser(description = "Profile the startup of the app")
+    parser.add_argument("--sentences", default = "data/test_data/sents.txt")
+    parser.add_argument("--limit", type = int, default = 25,
+                        help = "number of modules to report")
+    parser.add_argument("--json", action = "store_true",
+                        help = "print the timings as JSON")
+    args = parser.parse_args(argv)
+
+    from config import config
+    first_frame(args.sentences, config)
+    elapsed = timer() - start
+    profiler.uninstall()
+    tokenizer_loaded = "nltk" in sys.modules
+
+    if args.json:
+        print json.dumps({"first_frame_ms": elapsed * 1000,
+                          "tokenizer_loaded": tokenizer_loaded,
+                          "imports_ms": dict((name, times[0] * 1000)
+                                             for name, times in profiler.records.items())})
+    else:
+        print profiler.report(args.limit)
+        print
+        print "time to first frame: %.1f ms" %(elapsed * 1000)
+        if tokenizer_loaded:
+            print "(the first sentence was tokenized: `python token_cache.py %s` avoids it)" %(args.sentences)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
+from itertools import groupby
+
 from op import (Op, Label, CancelLabel, 
                 CursorMoveOp, CursorLeft, CursorRight, CursorUp, CursorDown, 
-                ConfirmSentence, SetMark)
+                ConfirmSentence, SetMark, Undo, Redo, 
+                NavigationOp, PrevSentence, NextSentence, GotoSentence)
+from session import SessionError
+from duplicates import record_link
+from query_index import spans_of_rows
 from sent import Sentence
 from display import DisplayData
+from prefetch import SentencePrefetcher
+from span_index import (SpanIndex, OverlapError)
+from label_vocab import LabelVocab
+
+# operations written to the op log
+LOGGED_OPS = (Label, CancelLabel, SetMark, Undo, Redo)
 
 class StateManager(object):
     """
@@ -63,32 +75,189 @@ class StateManager(object):
     >>> os.remove("data/test_data/output/0.txt")
     >>> os.remove("data/test_data/output/1.txt")
     """
-    def __init__(self, session, label_groups):
+    def __init__(self, session, label_groups, prefetch_depth = 0, overlap_policy = "replace", 
+                 vocab = None, gazetteer = None, prelabel = False, oplog = None, 
+                 duplicates = None, duplicate_policy = "apply", query_index = None):
         self.session = session
-        
-        self.set_sentence(session.next_sentence())
+        self.overlap_policy = overlap_policy
+        self.vocab = vocab if vocab is not None else LabelVocab()
 
-        self.label_groups = label_groups
+        # phrases highlighted in every sentence, and labeled beforehand if `prelabel`
+        self.gazetteer = gazetteer
+        self.prelabel = prelabel
+        self.highlights = None
+
+        # copies of a confirmed sentence get its labels ("apply") or are saved with them unseen ("skip")
+        self.duplicates = duplicates
+        self.duplicate_policy = duplicate_policy
+        self.duplicate_of = None
+
+        # label statistics of the confirmed sentences
+        self.query_index = query_index
+
+        self.prefetch_depth = prefetch_depth
+        if prefetch_depth > 0:
+            self.prefetcher = SentencePrefetcher(session, prefetch_depth)
+        else:
+            self.prefetcher = None
         
+        self.label_groups = label_groups
+
+        # gives the wrap layout of the annotation, for moving up and down
+        self.layout_provider = None
+
+        # version of the last display data and what changed since then
+        self.version = 0
+        self.displayed_range = None
+        self.changed = None
+
+        # what was done to the sentence in progress, replayed if it was interrupted
+        self.oplog = oplog
+        if oplog is not None:
+            logged_sent_id, records = oplog.recover()
+
+        self.set_sentence(self.next_sentence())
         self.reset()
+        self.load_saved_annotation()
+
+        if oplog is not None:
+            if logged_sent_id is not None and logged_sent_id == self.session.current_sent_id:
+                self.replay(records)
+                oplog.resume()
+            else:
+                oplog.begin(self.session.current_sent_id)
         
     def reset(self):
         self.selection_anchor = None
         self.selection_offset = None
 
         self.current_index = 0
+        # column kept by successive vertical moves
+        self.goal_col = None
 
         self.select_on = False
 
-        self.labeled_ranges = []
+        # labeled spans of every label group
+        self.span_indices = dict((group, SpanIndex(self.overlap_policy)) 
+                                 for group in self.label_groups)
+
+        # edits as (state before, state after, [(group, removed spans, added spans)])
+        self.undo_stack = []
+        self.redo_stack = []
         
     def set_sentence(self, sent):
-        """ sent is unicode string"""
-        self.sent = Sentence.from_unicode(sent)
+        """ sent is unicode string or an already tokenized Sentence"""
+        if not isinstance(sent, Sentence):
+            sent = Sentence.from_unicode(sent)
+        sent.use_vocab(self.vocab)
+        self.sent = sent
         self.index_max = len(self.sent) - 1
 
+        # the live annotation model, only updated by labeling
+        self.annotation = [self.word_annotation(i) for i in xrange(len(self.sent))]
+        self.changed = None
+
+        if self.gazetteer is not None:
+            self.matches = self.gazetteer.longest_matches(self.sent.words)
+            self.highlights = frozenset(i for start, end, group, name in self.matches
+                                        for i in xrange(start, end + 1))
+        else:
+            self.matches = None
+
+    def apply_matches(self):
+        """
+        Label the gazetteer matches of the sentence, unless they
+        overlap spans already there
+
+        >>> from session import AnnotationSession
+        >>> from gazetteer import Gazetteer
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> gazetteer = Gazetteer([([u"b", u"c"], "role", "object"), ([u"e"], "role", "subject")])
+        >>> sm = StateManager(session, ["role"], gazetteer = gazetteer, prelabel = True)
+        >>> data = sm.get_display_data()
+        >>> data
+        DisplayData(start=0, end=0, data=[(u'a', u'-'), (u'b', u'object'), (u'c', u'object')])
+        >>> sorted(data.highlights)
+        [1, 2]
+        >>> sm.receive(ConfirmSentence())
+        >>> sm.get_spans()
+        [(1, 1, 'role', 'subject')]
+        >>> import os
+        >>> os.remove("data/test_data/session.pkl")
+        >>> os.remove("data/test_data/output/0.txt")
+        """
+        for start, end, group, name in self.matches:
+            index = self.span_indices.get(group)
+            if index is None or index.overlapping(start, end):
+                continue
+            index.add(start, end, name)
+            self.set_span_label(group, start, end, name)
+
+    def next_sentence(self):
+        while True:
+            if self.prefetcher is not None:
+                sent = self.prefetcher.next_sentence()
+            else:
+                sent = self.session.next_sentence()
+            if self.duplicate_policy != "skip" or not self.skip_duplicate(sent):
+                return sent
+
+    def find_original(self, sent):
+        """id of the first confirmed sentence with the text of `sent`, the current one"""
+        if self.duplicates is None:
+            return None
+        text = sent.text if isinstance(sent, Sentence) else sent
+        if text is None:
+            return None
+        sent_id = self.session.current_sent_id
+        for original_id in self.duplicates.copies(text):
+            if original_id != sent_id and original_id in self.session.store:
+                return original_id
+        return None
+
+    def skip_duplicate(self, sent):
+        """
+        Save the current sentence with the labels of its confirmed copy
+        if it has one, True if it was
+
+        >>> import tempfile, shutil
+        >>> from session import AnnotationSession
+        >>> from duplicates import DuplicateIndex
+        >>> from query_index import QueryIndex
+        >>> d = tempfile.mkdtemp()
+        >>> with open(d + "/sents.txt", "w") as f:
+        ...     f.write("a b\\na  b\\nc d\\nc d\\n")
+        >>> session = AnnotationSession(d + "/session.pkl", d + "/sents.txt", d)
+        >>> sm = StateManager(session, ["role"], duplicates = DuplicateIndex.build(d + "/sents.txt"), 
+        ...                   duplicate_policy = "skip", query_index = QueryIndex(d + "/index.db"))
+        >>> sm.receive(Label("role", "subject")); sm.receive(ConfirmSentence())
+        >>> session.current_sent_id, session.store.read(1) # sentence 1 was skipped
+        (2, [(u'a', u'subject'), (u'b', u'-')])
+        >>> sm.duplicate_policy = "apply"
+        >>> sm.receive(CursorRight()); sm.receive(Label("role", "object")); sm.receive(ConfirmSentence())
+        >>> session.current_sent_id, sm.get_spans(), sm.duplicate_of
+        (3, [(1, 1, 'role', u'object')], 2)
+        >>> sm.receive(ConfirmSentence())
+        >>> print open(d + "/duplicates.tsv").read().replace("\\t", "|"),
+        1|0|skip
+        3|2|apply
+        >>> index = QueryIndex(d + "/index.db"); index.count()
+        [(u'role', u'object', 2, 2), (u'role', u'subject', 2, 2)]
+        >>> index.close(); sm.close()
+        >>> shutil.rmtree(d)
+        """
+        original_id = self.find_original(sent)
+        if original_id is None:
+            return False
+        rows = self.session.store.read(original_id)
+        self.session.save_annotation(rows)
+        self.index_saved(spans_of_rows(rows, self.label_groups))
+        record_link(self.session.store.output_dir, self.session.current_sent_id, original_id, "skip")
+        return True
+
     def receive(self, op):
         assert isinstance(op, Op)
+        state = self.cursor_state()
         if isinstance(op, CursorMoveOp):
             if isinstance(op, CursorLeft):
                 self.cursor_left()
@@ -107,6 +276,95 @@ class StateManager(object):
             self.confirm_sentence()
         elif isinstance(op, SetMark):
             self.set_mark()
+        elif isinstance(op, Undo):
+            self.undo()
+        elif isinstance(op, Redo):
+            self.redo()
+        elif isinstance(op, NavigationOp):
+            if isinstance(op, PrevSentence):
+                self.goto_sentence(self.session.current_sent_id - 1)
+            elif isinstance(op, NextSentence):
+                self.goto_sentence(self.session.current_sent_id + 1)
+            elif isinstance(op, GotoSentence):
+                self.goto_sentence(op.sent_id)
+
+        if self.oplog is not None and isinstance(op, LOGGED_OPS):
+            self.oplog.append(op, state)
+
+    def cursor_state(self):
+        return (self.current_index, self.select_on, self.selection_anchor, self.selection_offset)
+
+    def restore_cursor_state(self, state):
+        self.current_index, self.select_on, self.selection_anchor, self.selection_offset = state
+
+    def replay(self, records):
+        """
+        Apply the logged (op, cursor state) records again, without logging them
+
+        >>> from session import AnnotationSession
+        >>> from oplog import OpLog
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, ["role"], oplog = OpLog("data/test_data/session.ops"))
+        >>> sm.receive(SetMark()); sm.receive(CursorRight()); sm.receive(Label("role", "subject"))
+        >>> sm.receive(Label("role", "object")); sm.receive(SetMark())
+        >>> sm.receive(Undo()); sm.receive(Undo()); sm.receive(Redo())
+        >>> sm.get_spans(), sm.cursor_state()
+        ([(0, 1, 'role', 'subject')], (1, False, 0, 1))
+        >>> sm.close() # crashed halfway
+        >>> session = AnnotationSession("data/test_data/session.pkl")
+        >>> sm = StateManager(session, ["role"], oplog = OpLog("data/test_data/session.ops"))
+        >>> sm.get_spans(), sm.cursor_state()
+        ([(0, 1, 'role', u'subject')], (1, False, 0, 1))
+        >>> sm.receive(Redo()); sm.get_spans()
+        [(1, 1, 'role', u'object')]
+        >>> sm.receive(ConfirmSentence()); sm.close()
+        >>> session = AnnotationSession("data/test_data/session.pkl")
+        >>> sm = StateManager(session, ["role"], oplog = OpLog("data/test_data/session.ops"))
+        >>> sm.get_spans(), sm.session.current_sent_id
+        ([], 1)
+        >>> sm.close()
+        >>> import os
+        >>> for path in ["data/test_data/session.pkl", "data/test_data/session.ops", "data/test_data/output/0.txt"]:
+        ...     os.remove(path)
+        """
+        oplog, self.oplog = self.oplog, None
+        try:
+            for op, state in records:
+                self.restore_cursor_state(state)
+                self.receive(op)
+        finally:
+            self.oplog = oplog
+
+    def record_edit(self, before, changes):
+        self.undo_stack.append((before, self.cursor_state(), changes))
+        del self.redo_stack[:]
+
+    def replace_spans(self, group, old_spans, new_spans):
+        index = self.span_indices[group]
+        for start, end, name in old_spans:
+            index.remove_at(start)
+            self.unset_span_label(group, start, end)
+        for start, end, name in new_spans:
+            index.add(start, end, name)
+            self.set_span_label(group, start, end, name)
+
+    def undo(self):
+        """Revert the last labeling edit, if any"""
+        if self.undo_stack:
+            before, after, changes = edit = self.undo_stack.pop()
+            for group, removed, added in reversed(changes):
+                self.replace_spans(group, added, removed)
+            self.restore_cursor_state(before)
+            self.redo_stack.append(edit)
+
+    def redo(self):
+        """Apply the last undone edit again, if any"""
+        if self.redo_stack:
+            before, after, changes = edit = self.redo_stack.pop()
+            for group, removed, added in changes:
+                self.replace_spans(group, removed, added)
+            self.restore_cursor_state(after)
+            self.undo_stack.append(edit)
 
     def get_selection_range(self):
         if self.select_on:
@@ -119,35 +377,254 @@ class StateManager(object):
         return start_index, end_index
 
     def label(self, label):
+        before = self.cursor_state()
         start_index, end_index = self.get_selection_range()
-        self.labeled_ranges.append((start_index, end_index))
+        index = self.span_indices.setdefault(label.group, SpanIndex(self.overlap_policy))
+        try:
+            displaced = index.add(start_index, end_index, label.name)
+        except OverlapError:
+            # the selection is dropped as if the label was given
+            self.select_on = False
+            raise
 
-        for word in self.sent[start_index : end_index+1]:
-            word.set_label(label.group, label.name)
+        for start, end, name in displaced:
+            self.unset_span_label(label.group, start, end)
+        # what is left of trimmed spans
+        for start, end, name in index.overlapping(*self.spans_range(displaced)):
+            self.set_span_label(label.group, start, end, name)
+
+        self.set_span_label(label.group, start_index, end_index, label.name)
             
         # quit selection mode
         self.select_on = False
 
+        added = index.overlapping(*self.spans_range(displaced + [(start_index, end_index, label.name)]))
+        self.record_edit(before, [(label.group, displaced, added)])
+
     def cancel_label(self):
-        for i, (start, end) in enumerate(self.labeled_ranges):
-            if self.current_index >= start and self.current_index <= end:
-                for word in self.sent[start: end+1]:
-                    word.reset_label()
+        """Remove the spans under the cursor, in every label group"""
+        changes = []
+        for group, index in self.span_indices.items():
+            span = index.remove_at(self.current_index)
+            if span is not None:
+                start, end, name = span
+                self.unset_span_label(group, start, end)
+                changes.append((group, [span], []))
+        if changes:
+            self.record_edit(self.cursor_state(), changes)
+
+    def set_span_label(self, group, start, end, name):
+        self.sent.set_label(group, start, end, name)
+        self.update_annotation(start, end)
+
+    def unset_span_label(self, group, start, end):
+        self.sent.unset_label(group, start, end)
+        self.update_annotation(start, end)
+
+    @staticmethod
+    def spans_range(spans):
+        if not spans:
+            return (0, -1)
+        return (min(s for s, e, n in spans), max(e for s, e, n in spans))
+
+    def get_spans(self):
+        """
+        All labeled spans as (start, end, group, name), sorted by position
 
-                self.labeled_ranges.remove(self.labeled_ranges[i])
-                break
+        >>> from session import AnnotationSession
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, label_groups = ["role", "is_product"])
+        >>> sm.receive(SetMark()); sm.receive(CursorRight()); sm.receive(Label("role", "subject"))
+        >>> sm.receive(Label("is_product", "product"))
+        >>> sm.get_spans()
+        [(0, 1, 'role', 'subject'), (1, 1, 'is_product', 'product')]
+        >>> sm.receive(CursorLeft()); sm.receive(Label("role", "object"))
+        >>> sm.get_spans()
+        [(0, 0, 'role', 'object'), (1, 1, 'is_product', 'product')]
+        >>> sm.get_display_data()
+        DisplayData(start=0, end=0, data=[(u'a', u'object', u'-'), (u'b', u'-', u'product'), (u'c', u'-', u'-')])
+        >>> import os
+        >>> os.remove("data/test_data/session.pkl")
+        """
+        spans = [(start, end, group, name) 
+                 for group, index in self.span_indices.items()
+                 for start, end, name in index.spans()]
+        return sorted(spans)
 
     def confirm_sentence(self):
+        """
+        Save the sentence and move on to the next one
+
+        >>> from session import AnnotationSession
+        >>> from oplog import OpLog
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, ["role"], oplog = OpLog("data/test_data/session.ops"))
+        >>> sm.receive(ConfirmSentence()); sm.receive(Label("role", "subject")); sm.receive(ConfirmSentence())
+        >>> sm.sent.words
+        ['Sentence', 'exhausts']
+        >>> sm.receive(Label("role", "subject")) # past the end, nothing to log
+        >>> OpLog("data/test_data/session.ops").recover()
+        (None, [])
+        >>> import os
+        >>> for path in ["data/test_data/session.pkl", "data/test_data/session.ops",
+        ...              "data/test_data/output/0.txt", "data/test_data/output/1.txt"]:
+        ...     os.remove(path)
+        """
         # save
-        self.session.save_annotation(self.get_annotation_data())
+        rows = self.get_annotation_data()
+        self.session.save_annotation(rows)
+        self.index_saved(spans_of_rows(rows, self.label_groups))
+        if self.duplicate_of is not None:
+            record_link(self.session.store.output_dir, self.session.current_sent_id, 
+                        self.duplicate_of, "apply")
 
         # move on
         try:
-            self.set_sentence(self.session.next_sentence())            
+            sent = self.next_sentence()
         except IOError:
             self.set_sentence("Sentence exhausts")
-            self.session.close()
+            if self.oplog is not None:
+                self.oplog.end()
+            self.close()
+            self.reset()
+        else:
+            self.start_sentence(sent)
+
+    def index_saved(self, spans):
+        """
+        Put the spans of the sentence just saved in the query index, as
+        `query_index.rebuild` would find them in the saved rows
+
+        >>> import tempfile, shutil
+        >>> from session import AnnotationSession
+        >>> from query_index import QueryIndex
+        >>> d = tempfile.mkdtemp()
+        >>> session = AnnotationSession(d + "/session.pkl", "data/test_data/sents.txt", d)
+        >>> sm = StateManager(session, ["role"], query_index = QueryIndex(d + "/index.db"))
+        >>> sm.receive(Label("role", "subject")); sm.receive(CursorRight()); sm.receive(Label("role", "subject"))
+        >>> sm.receive(ConfirmSentence()); sm.query_index.spans(0)
+        [(0, 1, u'role', u'subject')]
+        >>> sm.close()
+        >>> shutil.rmtree(d)
+        """
+        if self.query_index is not None:
+            self.query_index.update(self.session.current_sent_id, spans)
+
+    def start_sentence(self, sent):
+        """Show `sent`, the session's current sentence, from its saved state"""
+        self.set_sentence(sent)
         self.reset()
+        self.load_saved_annotation()
+        if self.oplog is not None:
+            self.oplog.begin(self.session.current_sent_id)
+
+    def load_saved_annotation(self):
+        """
+        Labels saved for the current sentence, else those of a confirmed copy
+        if applying them, else the gazetteer matches if prelabeling
+
+        The saved labels are loaded alone, so that the matches removed
+        before confirming do not come back
+
+        >>> from session import AnnotationSession
+        >>> from gazetteer import Gazetteer
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output", random_access = True)
+        >>> gazetteer = Gazetteer([([u"b", u"c"], "role", "object")])
+        >>> sm = StateManager(session, ["role"], overlap_policy = "reject", gazetteer = gazetteer, prelabel = True)
+        >>> sm.receive(CursorRight()); sm.receive(CancelLabel()); sm.receive(Label("role", "subject"))
+        >>> sm.receive(ConfirmSentence()); sm.receive(PrevSentence())
+        >>> sm.get_spans()
+        [(1, 1, 'role', u'subject')]
+        >>> sm.close()
+        >>> import os
+        >>> for path in ["data/test_data/session.pkl", "data/test_data/sents.txt.idx", "data/test_data/output/0.txt"]:
+        ...     os.remove(path)
+        """
+        self.duplicate_of = None
+        sent_id = self.session.current_sent_id
+        if sent_id is not None and sent_id >= 0 and sent_id in self.session.store:
+            self.load_annotation(self.session.store.read(sent_id))
+            return
+        if self.duplicate_policy == "apply":
+            original_id = self.find_original(self.sent)
+            if original_id is not None:
+                self.load_annotation(self.session.store.read(original_id))
+                self.duplicate_of = original_id
+                return
+        if self.prelabel and self.matches:
+            self.apply_matches()
+
+    def goto_sentence(self, sent_id):
+        """
+        Leave the current sentence without saving it for sentence `sent_id`,
+        shown with its saved annotation if there is one
+
+        >>> from session import AnnotationSession
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output", random_access = True)
+        >>> sm = StateManager(session, ["role"], prefetch_depth = 2)
+        >>> sm.receive(SetMark()); sm.receive(CursorRight()); sm.receive(Label("role", "subject"))
+        >>> sm.receive(ConfirmSentence())
+        >>> sm.get_display_data()
+        DisplayData(start=0, end=0, data=[(u'd', u'-'), (u'e', u'-'), (u'f', u'-')])
+        >>> sm.receive(PrevSentence())
+        >>> sm.get_display_data()
+        DisplayData(start=0, end=0, data=[(u'a', u'subject'), (u'b', u'subject'), (u'c', u'-')])
+        >>> sm.get_spans()
+        [(0, 1, 'role', u'subject')]
+        >>> sm.receive(GotoSentence(5)) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        SessionError: No sentence 5, there are 2
+        >>> sm.receive(NextSentence()); sm.get_display_data()
+        DisplayData(start=0, end=0, data=[(u'd', u'-'), (u'e', u'-'), (u'f', u'-')])
+        >>> sm.close()
+        >>> import os
+        >>> for path in ["data/test_data/session.pkl", "data/test_data/sents.txt.idx", "data/test_data/output/0.txt"]:
+        ...     os.remove(path)
+        """
+        count = getattr(self.session, "sentence_count", None)
+        if count is None:
+            raise SessionError("This session can only move forward")
+        if not 0 <= sent_id < count:
+            raise SessionError("No sentence %d, there are %d" %(sent_id, count))
+
+        # what was prefetched follows the old position
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        try:
+            line = self.session.goto_sentence(sent_id)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher = SentencePrefetcher(self.session, self.prefetch_depth)
+
+        self.start_sentence(line)
+
+    def load_annotation(self, rows, missing = u"-"):
+        """
+        Label the spans of saved annotation rows (word, label of every group),
+        the sentence having no label yet
+        """
+        if len(rows) != len(self.sent) or any(len(row) != len(self.label_groups) + 1 for row in rows):
+            return # not saved with these label groups
+        for column, group in enumerate(self.label_groups, 1):
+            # the runs of a column never overlap, so adding them to a fresh index cannot fail
+            index = self.span_indices[group] = SpanIndex(self.overlap_policy)
+            start = 0
+            for name, run in groupby(row[column] for row in rows):
+                end = start + len(list(run)) - 1
+                if name != missing:
+                    index.add(start, end, name)
+                    self.set_span_label(group, start, end, name)
+                start = end + 1
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.oplog is not None:
+            self.oplog.close()
+        if self.query_index is not None:
+            self.query_index.close()
+        self.session.close()
 
     def set_mark(self):
         if self.select_on:
@@ -163,6 +640,7 @@ class StateManager(object):
             self.selection_offset = None
 
     def cursor_left(self):
+        self.goal_col = None
         if self.select_on:
             if self.selection_anchor + self.selection_offset > 0:
                 self.selection_offset -= 1
@@ -174,6 +652,7 @@ class StateManager(object):
                 self.current_index = self.index_max
                 
     def cursor_right(self):
+        self.goal_col = None
         if self.select_on:
             if self.selection_anchor + self.selection_offset < self.index_max:
                 self.selection_offset += 1
@@ -185,22 +664,90 @@ class StateManager(object):
                 self.current_index = 0
 
     def cursor_up(self):
-        raise NotImplementedError
+        self.cursor_vertical(-1)
 
     def cursor_down(self):
-        raise NotImplementedError
+        self.cursor_vertical(1)
+
+    def cursor_vertical(self, step):
+        """
+        Move to the word closest to the cursor column in the row `step` rows away,
+        as the sentence is wrapped on screen. Nothing happens past the first
+        or last row, or if there is no layout provider
+
+        >>> from session import AnnotationSession
+        >>> from display import Display
+        >>> from fake_screen import (FakeScreen, fake_curses)
+        >>> from test_config import config
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, label_groups = ["label_set1"])
+        >>> display = Display(FakeScreen(), config, curses_lib = fake_curses)
+        >>> display.max_col = 4 # a word per row
+        >>> sm.layout_provider = display
+        >>> sm.receive(CursorDown()); sm.current_index
+        1
+        >>> sm.receive(SetMark()); sm.receive(CursorDown()); sm.receive(CursorDown())
+        >>> sm.current_index, sm.get_selection_range()
+        (2, (1, 2))
+        >>> sm.receive(CursorUp()); sm.receive(CursorUp()); sm.current_index, sm.get_selection_range()
+        (0, (0, 1))
+        >>> sm.close()
+        >>> import os
+        >>> os.remove("data/test_data/session.pkl")
+        """
+        if self.layout_provider is None:
+            return
+        layout = self.layout_provider.layout_of(self.annotation)
+        row, col = layout.position(self.current_index)
+        if self.goal_col is None:
+            self.goal_col = col
+        target = layout.nearest_in_row(row + step, self.goal_col)
+        if target is None:
+            return
+        if self.select_on:
+            self.selection_offset += target - self.current_index
+        self.current_index = target
+
+    def word_annotation(self, i):
+        return self.sent.row(i, self.label_groups)
+
+    def update_annotation(self, start, end):
+        for i in xrange(start, end+1):
+            self.annotation[i] = self.word_annotation(i)
+        if self.changed is not None:
+            self.changed.update(xrange(start, end+1))
 
     def get_annotation_data(self):
-        data = []
-        for w in self.sent:
-            item = [unicode(w)] 
-            item += [unicode(w.labels.get(key, "-")) for key in self.label_groups]
-            data.append(tuple(item))
-        return data
+        return list(self.annotation)
         
     def get_display_data(self):
-        data = self.get_annotation_data()
-        
+        """
+        Display data holding the live annotation model, along with what 
+        changed since the previous call
+
+        >>> from session import AnnotationSession
+        >>> session = AnnotationSession("data/test_data/session.pkl", "data/test_data/sents.txt", "data/test_data/output")
+        >>> sm = StateManager(session, label_groups = ["label_set1"])
+        >>> data = sm.get_display_data()
+        >>> data.changed is None
+        True
+        >>> sm.receive(CursorRight()); sm.receive(Label("label_set1", "some_label"))
+        >>> data = sm.get_display_data()
+        >>> sorted(data.changed), data.prev_range, (data.start_index, data.end_index)
+        ([1], (0, 0), (1, 1))
+        >>> data.base + 1 == data.version
+        True
+        >>> import os
+        >>> os.remove("data/test_data/session.pkl")
+        """
         start, end = self.get_selection_range()
+
+        self.version += 1
+        base = self.version - 1 if self.displayed_range is not None else None
+        data = DisplayData(start, end, self.annotation, self.changed, 
+                           self.displayed_range, base, self.version, self.highlights)
+
+        self.changed = set()
+        self.displayed_range = (start, end)
         
-        return DisplayData(start, end, data)
+        return data
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Storage backends for confirmed annotations
+"""
+import os
+import re
+import json
+import codecs
+import struct
+
+SEGMENT_SIZE = 64 << 20
+
+INDEX_FILE = "index.bin"
+INDEX_RECORD = struct.Struct("<qIQI") # sent_id, segment, offset, length
+
+
+class StoreError(Exception):
+    pass
+
+
+class FileStore(object):
+    """
+    One `tabulate` formatted file per sentence, `output_dir/<sent_id>.txt`
+
+    >>> store = FileStore("data/test_data/output")
+    >>> store.write(0, [(u'a', u'-'), (u'\\u20ac', u'PROD')])
+    >>> print open("data/test_data/output/0.txt").read()
+    a  -
+    €  PROD
+    >>> store.read(0)
+    [(u'a', u'-'), (u'\\u20ac', u'PROD')]
+    >>> 0 in store, 1 in store
+    (True, False)
+    >>> os.remove("data/test_data/output/0.txt")
+    """
+    format = "files"
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def path(self, sent_id):
+        return os.path.join(self.output_dir, "%d.txt" %(sent_id))
+
+    def write(self, sent_id, annotation):
+        import tabulate # only needed by this layout and slow to import
+        with codecs.open(self.path(sent_id), "w", "utf8") as f:
+            f.write(tabulate.tabulate(annotation, tablefmt="plain"))
+
+    def read(self, sent_id):
+        with codecs.open(self.path(sent_id), "r", "utf8") as f:
+            return [tuple(line.split()) for line in f if line.strip()]
+
+    def sent_ids(self):
+        ids = [int(name[:-4]) for name in os.listdir(self.output_dir)
+               if re.match(r"^\d+\.txt$", name)]
+        return sorted(ids)
+
+    def __contains__(self, sent_id):
+        return os.path.exists(self.path(sent_id))
+
+    def close(self):
+        pass
+
+
+class SegmentStore(object):
+    """
+    Appends annotations to rotating segment files in `output_dir`
+
+    Records are either CoNLL style (tab separated columns, a `# sent_id`
+    comment and a blank line as terminator) or one JSON object per line.
+    `index.bin` maps sentence id to (segment, offset, length) and is
+    append-only as well, so re-writing a sentence appends a new record
+    and the latest one wins.
+
+    >>> import shutil, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> store = SegmentStore(d, "conll", segment_size = 50)
+    >>> store.write(0, [(u'a', u'-'), (u'b', u'PROD')])
+    >>> store.write(1, [(u'\\u20ac', u'-')])
+    >>> store.write(0, [(u'a', u'PER'), (u'b', u'PROD')])
+    >>> print open(os.path.join(d, "segment-00000.conll")).read().replace("\\t", "|")
+    # sent_id = 0
+    a|-
+    b|PROD
+    <BLANKLINE>
+    # sent_id = 1
+    €|-
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> sorted(os.listdir(d))
+    ['index.bin', 'segment-00000.conll', 'segment-00001.conll']
+    >>> store.close()
+    >>> store = SegmentStore(d, "conll")
+    >>> store.read(0)
+    [(u'a', u'PER'), (u'b', u'PROD')]
+    >>> store.read(1)
+    [(u'\\u20ac', u'-')]
+    >>> store.sent_ids()
+    [0, 1]
+    >>> store.close()
+    >>> with open(os.path.join(d, "index.bin"), "ab") as f:
+    ...     f.write("torn")
+    >>> store = SegmentStore(d, "conll")
+    >>> store.write(2, [(u'c', u'-')]); store.close()
+    >>> store = SegmentStore(d, "conll")
+    >>> store.sent_ids(), store.read(2)
+    ([0, 1, 2], [(u'c', u'-')])
+    >>> store.write(3, [(u'#', u'-'), (u'#tag', u'PER')]); store.read(3)
+    [(u'#', u'-'), (u'#tag', u'PER')]
+    >>> store.close()
+    >>> shutil.rmtree(d)
+    """
+    extensions = {"conll": "conll", "jsonl": "jsonl"}
+
+    def __init__(self, output_dir, format = "conll", segment_size = SEGMENT_SIZE):
+        if format not in self.extensions:
+            raise StoreError("Unknown segment format %r" %(format))
+        self.output_dir = output_dir
+        self.format = format
+        self.segment_size = segment_size
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.index = {}
+        self.index_path = os.path.join(output_dir, INDEX_FILE)
+        if os.path.exists(self.index_path):
+            self._load_index()
+
+        segments = self._segment_numbers()
+        self.segment_no = segments[-1] if segments else 0
+
+        self.segment_file = open(self.segment_path(self.segment_no), "ab")
+        self.index_file = open(self.index_path, "ab")
+
+    def _segment_numbers(self):
+        pattern = re.compile(r"^segment-(\d+)\.%s$" %(self.extensions[self.format]))
+        numbers = []
+        for name in os.listdir(self.output_dir):
+            m = pattern.match(name)
+            if m:
+                numbers.append(int(m.group(1)))
+        return sorted(numbers)
+
+    def _load_index(self):
+        size = INDEX_RECORD.size
+        with open(self.index_path, "r+b") as f:
+            while True:
+                record = f.read(size)
+                if len(record) < size:
+                    break
+                sent_id, segment, offset, length = INDEX_RECORD.unpack(record)
+                self.index[sent_id] = (segment, offset, length)
+            # drop a torn last record, so that the next ones are appended aligned
+            f.truncate(os.path.getsize(self.index_path) // size * size)
+
+    def segment_path(self, segment_no):
+        return os.path.join(self.output_dir, "segment-%05d.%s"
+                            %(segment_no, self.extensions[self.format]))
+
+    def encode(self, sent_id, annotation):
+        if self.format == "jsonl":
+            rows = [[unicode(c) for c in row] for row in annotation]
+            record = json.dumps({"sent_id": sent_id, "rows": rows}, ensure_ascii = False) + u"\n"
+        else:
+            lines = [u"# sent_id = %d" %(sent_id)]
+            lines += [u"\t".join(unicode(c) for c in row) for row in annotation]
+            record = u"\n".join(lines) + u"\n\n"
+        return record.encode("utf8")
+
+    def decode(self, data):
+        data = data.decode("utf8")
+        if self.format == "jsonl":
+            return [tuple(row) for row in json.loads(data)["rows"]]
+        else:
+            lines = data.split(u"\n")
+            if lines[0].startswith(u"# sent_id"): # the header written by `encode`
+                lines = lines[1:]
+            return [tuple(line.split(u"\t")) for line in lines if line]
+
+    def write(self, sent_id, annotation):
+        record = self.encode(sent_id, annotation)
+
+        offset = self.segment_file.tell()
+        if offset > 0 and offset + len(record) > self.segment_size:
+            self.segment_file.close()
+            self.segment_no += 1
+            self.segment_file = open(self.segment_path(self.segment_no), "ab")
+            offset = 0
+
+        self.segment_file.write(record)
+        self.segment_file.flush()
+
+        self.index_file.write(INDEX_RECORD.pack(sent_id, self.segment_no, offset, len(record)))
+        self.index_file.flush()
+
+        self.index[sent_id] = (self.segment_no, offset, len(record))
+
+    def read_raw(self, sent_id):
+        try:
+            segment, offset, length = self.index[sent_id]
+        except KeyError:
+            raise StoreError("No annotation for sentence %d" %(sent_id))
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read(self, sent_id):
+        return self.decode(self.read_raw(sent_id))
+
+    def sent_ids(self):
+        return sorted(self.index)
+
+    def __contains__(self, sent_id):
+        return sent_id in self.index
+
+    def close(self):
+        self.segment_file.close()
+        self.index_file.close()
+
+
+def open_store(output_dir, format = "files", **kwargs):
+    """
+    Store for `output_dir`, either the one-file-per-sentence layout ("files")
+    or a segmented one ("conll" or "jsonl")
+    """
+    if format == "files":
+        return FileStore(output_dir)
+    else:
+        return SegmentStore(output_dir, format, **kwargs)
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Sentences tokenized once, ahead of the annotation sessions
+
+    python token_cache.py SENTENCES [--output PATH] [--processes N]
+
+The cache (`SENTENCES.tok` by default) is used by the sessions as long as
+it was made from the same sentence file with the installed tokenizer, so
+that no sentence is tokenized while annotating
+"""
+import os
+import imp
+import mmap
+import struct
+import hashlib
+import argparse
+from array import array
+from timeit import default_timer as timer
+try:
+    from cPickle import (loads, dumps)
+except ImportError:
+    from pickle import (loads, dumps)
+
+from sent import Sentence
+from line_index import file_fingerprint
+from compressed import open_sentence_file
+from export import batches
+
+CACHE_SUFFIX = ".tok"
+CACHE_VERSION = 1
+TOKENIZER = "nltk.word_tokenize"
+
+HEADER_LENGTH = struct.Struct("<I")
+# room left after the header, for rewriting it with another fingerprint
+HEADER_SLACK = 64
+ITEM_SIZE = array("L").itemsize
+
+
+class StaleCacheError(Exception):
+    pass
+
+
+def tokenizer_version():
+    """The tokenizer of `Sentence.from_unicode` and its version, found without importing it"""
+    try:
+        package_path = imp.find_module("nltk")[1]
+        with open(os.path.join(package_path, "VERSION")) as f:
+            return "%s %s" %(TOKENIZER, f.read().strip())
+    except (ImportError, IOError):
+        return None
+
+
+def file_hash(path, chunk_size = 1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _tokenize_batch(lines):
+    """(token count of every line, byte length of every token, the tokens concatenated)"""
+    # tokens come from single lines, so a newline never occurs in them
+    counts, lengths, parts = array("L"), array("L"), []
+    for line in lines:
+        line = line.decode("utf8").strip()
+        tokens = Sentence.from_unicode(line).words if line else []
+        counts.append(len(tokens))
+        for token in tokens:
+            data = token.encode("utf8") + "\n"
+            lengths.append(len(data))
+            parts.append(data)
+    return counts, lengths, "".join(parts)
+
+
+def build(path, cache_path = None, processes = None, batch_size = 1000):
+    """
+    Tokenize the lines of `path` with a process pool into a cache file,
+    returning the number of lines
+
+    The file holds a header, then the number of tokens before every line,
+    the byte offset of every token and the tokens, UTF-8 encoded, each
+    followed by a newline. The sections are written to temporary files as the
+    batches come back, in order, and put together at the end
+    """
+    if cache_path is None:
+        cache_path = path + CACHE_SUFFIX
+    sections = [cache_path + ".%s.tmp" %(name) for name in ("index", "offsets", "blob")]
+    tmp_path = cache_path + ".tmp"
+    try:
+        return _build(path, cache_path, sections, tmp_path, processes, batch_size)
+    except:
+        for leftover in sections + [tmp_path]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+
+def _build(path, cache_path, sections, tmp_path, processes, batch_size):
+    fingerprint = file_fingerprint(path)
+    source_hash = file_hash(path)
+
+    index_f, offsets_f, blob_f = [open(section, "wb") for section in sections]
+    line_count = token_count = byte_count = 0
+    array("L", [0]).tofile(index_f)
+    array("L", [0]).tofile(offsets_f)
+
+    if processes == 1:
+        pool, imap = None, map
+    else:
+        from multiprocessing import (Pool, cpu_count)
+        pool = Pool(processes)
+        imap = pool.imap
+        processes = processes or cpu_count()
+
+    f = open_sentence_file(path)
+    try:
+        # a window of batches at a time keeps the memory bounded
+        window = batch_size * 4 * (processes or 1)
+        for lines in batches(f, window):
+            for counts, lengths, blob in imap(_tokenize_batch, list(batches(lines, batch_size))):
+                starts, ends = array("L"), array("L")
+                for count in counts:
+                    token_count += count
+                    starts.append(token_count)
+                for length in lengths:
+                    byte_count += length
+                    ends.append(byte_count)
+                starts.tofile(index_f)
+                ends.tofile(offsets_f)
+                blob_f.write(blob)
+                line_count += len(counts)
+    finally:
+        f.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for section_f in (index_f, offsets_f, blob_f):
+            section_f.close()
+
+    header = dumps({"version": CACHE_VERSION,
+                    "fingerprint": fingerprint,
+                    "source_hash": source_hash,
+                    "tokenizer": tokenizer_version(),
+                    "item_size": ITEM_SIZE,
+                    "lines": line_count,
+                    "tokens": token_count}, 2)
+    header += " " * HEADER_SLACK
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER_LENGTH.pack(len(header)) + header)
+        for section in sections:
+            with open(section, "rb") as section_f:
+                for chunk in iter(lambda: section_f.read(1 << 20), ""):
+                    out.write(chunk)
+            os.remove(section)
+    os.rename(tmp_path, cache_path)
+    return line_count
+
+
+class TokenCache(object):
+    """
+    The tokens of every line of a sentence file, memory-mapped: getting
+    a sentence slices the offsets and the tokens of its line, without
+    calling the tokenizer
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> shutil.copy("data/test_data/sents.txt", d)
+    >>> build(d + "/sents.txt", processes = 1)
+    2
+    >>> cache = TokenCache.for_file(d + "/sents.txt")
+    >>> len(cache), cache.tokens(1), cache.sentence(0, u"a b c").text
+    (2, [u'd', u'e', u'f'], u'a b c')
+    >>> print cache.sentence(2)
+    None
+    >>> cache.close()
+    >>> os.utime(d + "/sents.txt", (0, 0)) # same content, another fingerprint
+    >>> cache = TokenCache.for_file(d + "/sents.txt"); cache.close()
+    >>> TokenCache(d + "/sents.txt.tok").header["fingerprint"] == file_fingerprint(d + "/sents.txt")
+    True
+    >>> with open(d + "/sents.txt", "a") as f:
+    ...     f.write("g h\\n")
+    >>> print TokenCache.for_file(d + "/sents.txt")
+    None
+    >>> shutil.rmtree(d)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        try:
+            length, = HEADER_LENGTH.unpack(self.f.read(HEADER_LENGTH.size))
+            self.header = loads(self.f.read(length))
+        except (struct.error, EOFError, ValueError):
+            self.f.close()
+            raise StaleCacheError("'%s' is not a token cache" %(path))
+        if self.header.get("version") != CACHE_VERSION or self.header.get("item_size") != ITEM_SIZE:
+            self.f.close()
+            raise StaleCacheError("Unknown token cache version in '%s'" %(path))
+
+        self.header_length = length
+        self.index_pos = HEADER_LENGTH.size + length
+        self.offsets_pos = self.index_pos + (self.header["lines"] + 1) * ITEM_SIZE
+        self.blob_pos = self.offsets_pos + (self.header["tokens"] + 1) * ITEM_SIZE
+        self.data = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    @classmethod
+    def for_file(cls, path, cache_path = None):
+        """
+        The cache of `path`, None if there is none or it was made
+        from another version of the file or with another tokenizer
+        """
+        if cache_path is None:
+            cache_path = path + CACHE_SUFFIX
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            cache = cls(cache_path)
+        except StaleCacheError:
+            return None
+
+        header = cache.header
+        tokenizer = tokenizer_version()
+        if tokenizer is not None and header["tokenizer"] != tokenizer:
+            cache.close()
+            return None
+        fingerprint = file_fingerprint(path)
+        if tuple(header["fingerprint"]) != fingerprint:
+            if header["source_hash"] != file_hash(path):
+                cache.close()
+                return None
+            # the file was only touched or copied: it is not hashed again next time
+            cache.set_fingerprint(fingerprint)
+        return cache
+
+    def set_fingerprint(self, fingerprint):
+        """Rewrite the header with the fingerprint of the same file, if it fits"""
+        header = dumps(dict(self.header, fingerprint = fingerprint), 2)
+        if len(header) > self.header_length:
+            return
+        try:
+            with open(self.path, "r+b") as f:
+                f.seek(HEADER_LENGTH.size)
+                f.write(header.ljust(self.header_length))
+        except IOError:
+            return
+        self.header["fingerprint"] = fingerprint
+
+    def _array(self, pos, count):
+        return array("L", self.data[pos: pos + count * ITEM_SIZE])
+
+    def tokens(self, line_no):
+        start, end = self._array(self.index_pos + line_no * ITEM_SIZE, 2)
+        first, = self._array(self.offsets_pos + start * ITEM_SIZE, 1)
+        last, = self._array(self.offsets_pos + end * ITEM_SIZE, 1)
+        # the tokens of the line are decoded at once
+        return self.data[self.blob_pos + first: self.blob_pos + last].decode("utf8").split(u"\n")[:-1]
+
+    def sentence(self, line_no, text = None):
+        """The `Sentence` of line `line_no`, None if the cache has no such line"""
+        if not 0 <= line_no < len(self):
+            return None
+        return Sentence(self.tokens(line_no), text = text)
+
+    def __len__(self):
+        return self.header["lines"]
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Tokenize a sentence file once for the annotation sessions")
+    parser.add_argument("sentences")
+    parser.add_argument("--output", default = None, help = "cache path (default: SENTENCES%s)" %(CACHE_SUFFIX))
+    parser.add_argument("--processes", type = int, default = None,
+                        help = "size of the process pool (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    start = timer()
+    count = build(args.sentences, args.output, args.processes)
+    print "%d lines tokenized in %.1f s" %(count, timer() - start)
+
+
+if __name__ == "__main__":
+    main()
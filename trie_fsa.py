@@ -4,6 +4,22 @@ class InvalidTransition(Exception):
 
 class PathExist(Exception):
     pass
+
+class CompiledNode(object):
+    """
+    A trie node with everything needed to dispatch on it precomputed:
+    the child nodes, the values of all terminals reachable from it
+    and the valid inputs
+    """
+    __slots__ = ("trie", "next", "ops", "terminal_count", "terminal", "valid")
+
+    def __init__(self, trie, next, ops, valid):
+        self.trie = trie
+        self.next = next
+        self.ops = ops
+        self.terminal_count = len(ops)
+        self.terminal = ops[0] if len(ops) == 1 else None
+        self.valid = valid
     
 class TrieFSA(object):
     """
@@ -39,6 +55,14 @@ class TrieFSA(object):
     False
     >>> t.has_path('blah')
     False
+    >>> t.compile()
+    >>> t.take('f'); t.take('o')
+    >>> t.node.terminal_count, t.node.terminal
+    (1, '_end_')
+    >>> t.take('x') # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    InvalidTransition: "Invalid input 'x'. Valid are ['o']"
     """
     
     def __init__(self, last_key = None):
@@ -47,9 +71,15 @@ class TrieFSA(object):
         self.last_key = last_key
         self.state = root
         self.path = []
+
+        self.compiled = None # root of the compiled automaton
+        self.node = None
         
     def add_paths(self, iter_list, last_value_func = None):
         assert callable(last_value_func)
+        # the compiled automaton is out of date
+        self.compiled = None
+        self.node = None
         
         for iterable in iter_list:
             if self.has_path(iterable):
@@ -60,11 +90,40 @@ class TrieFSA(object):
                 cur_dict = cur_dict.setdefault(o, {})
             cur_dict[self.last_key] = last_value_func(iterable)
 
+    def compile(self):
+        """
+        Freeze the trie into an automaton so that taking an input and
+        knowing what it leads to are single lookups
+        """
+        def aux(state):
+            next = {}
+            ops = []
+            for key in state:
+                if key == self.last_key:
+                    ops.append(state[key])
+                else:
+                    next[key] = aux(state[key])
+                    ops += next[key].ops
+            valid = [k for k in state if k is not self.last_key]
+            return CompiledNode(state, next, ops, valid)
+
+        self.compiled = aux(self.root)
+        self.reset()
+
     def valid_input(self):
+        if self.node is not None:
+            return list(self.node.valid)
         return [k for k in self.state if k is not self.last_key]
         
     def take(self, key):
-        if key in self.state:
+        if self.node is not None:
+            try:
+                self.node = self.node.next[key]
+            except (KeyError, TypeError): # TypeError: unhashable input
+                raise InvalidTransition("\"Invalid input %r. Valid are %r\"" %(key, self.node.valid))
+            self.path.append(key)
+            self.state = self.node.trie
+        elif key in self.state:
             self.path.append(key)
             self.state = self.state[key]
         else:
@@ -73,6 +132,8 @@ class TrieFSA(object):
     def matching_paths(self):
         """
         Return the matching paths of the current state
+
+        Only meant for introspection, dispatching uses the compiled automaton
         """
         def aux(state, path):
             paths = []
@@ -88,6 +149,7 @@ class TrieFSA(object):
     def reset(self):
         self.state = self.root
         self.path = []
+        self.node = self.compiled
 
     def has_path(self, iterable):
         current = self.root
@@ -4,6 +4,10 @@ from errors import InvalidWordLabelError
 
 class Word(unicode):
     u"""
+    A token whose labels live in the label columns of its `Sentence`
+
+    A word created on its own gets a sentence of its own
+
     >>> w = Word(u"You")
     >>> w.set_label("role", "product")
     >>> w.labels
@@ -14,12 +18,25 @@ class Word(unicode):
     """
     
     
-    def __init__(self, s):
-        self.labels = {}
-        super(Word, self).__init__(s)
+    def __new__(cls, s, sent = None, index = 0):
+        return super(Word, cls).__new__(cls, s)
+
+    def __init__(self, s, sent = None, index = 0):
+        if sent is None:
+            from sent import Sentence
+            sent = Sentence([unicode(s)])
+        self.sent = sent
+        self.index = index
+
+    @property
+    def labels(self):
+        return self.sent.labels(self.index)
     
     def set_label(self, labelset_name, label):
-        self.labels[labelset_name] = label
+        self.sent.set_label(labelset_name, self.index, self.index, label)
+
+    def unset_label(self, labelset_name):
+        self.sent.unset_label(labelset_name, self.index, self.index)
 
     def reset_label(self):
-        self.labels = {}
+        self.sent.reset_label(self.index, self.index)
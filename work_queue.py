@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# coding=UTF-8
+"""
+Sentence ids claimed atomically by annotator processes sharing one corpus
+"""
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS claims (
+    sent_id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS claims_pending ON claims (done, lease_until);
+CREATE INDEX IF NOT EXISTS claims_owner ON claims (owner, done);
+"""
+
+
+class WorkQueueError(Exception):
+    pass
+
+
+class ClaimQueue(object):
+    """
+    A SQLite work queue over the sentence ids 0...total-1
+
+    Sentences are handed out in order. Only the claimed ones have a row,
+    with the owner and the time its lease runs out, so the queue of a
+    large corpus starts empty. Claiming runs in a write transaction,
+    which SQLite serializes between processes: no id is given twice
+    while its lease holds. An owner gets its own unfinished claim back
+    first (resuming after a restart), then ids whose lease ran out
+    (their owner crashed), then fresh ones
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> now = [0]
+    >>> queue = ClaimQueue(d + "/queue.db", total = 3, lease_seconds = 60, clock = lambda: now[0])
+    >>> queue.claim("ann"), queue.claim("bob")
+    (0, 1)
+    >>> queue.claim("ann") # still working on it
+    0
+    >>> queue.complete("ann", 0)
+    True
+    >>> now[0] = 100 # bob's lease has run out
+    >>> queue.claim("ann")
+    1
+    >>> queue.complete("bob", 1)
+    False
+    >>> queue.complete("ann", 1), queue.claim("ann"), queue.complete("ann", 2)
+    (True, 2, True)
+    >>> print queue.claim("ann")
+    None
+    >>> sorted(queue.progress().items())
+    [('claimed', 0), ('done', 3), ('expired', 0), ('total', 3)]
+    >>> queue.close()
+    >>> ClaimQueue(d + "/queue.db", total = 4) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    WorkQueueError: ...
+    >>> shutil.rmtree(d)
+    """
+    def __init__(self, path, total = None, lease_seconds = 600, corpus = None, clock = time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+
+        # transactions are managed explicitly
+        self.conn = sqlite3.connect(path, timeout = 60, isolation_level = None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        # in WAL mode a commit survives a crash of the process without an fsync
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        with self._transaction() as c:
+            self.total = self._check_meta(c, "total", total)
+            self.corpus = self._check_meta(c, "corpus", corpus)
+            c.execute("INSERT OR IGNORE INTO meta VALUES ('frontier', 0)")
+        if self.total is None:
+            raise WorkQueueError("Queue '%s' is not initialized" %(path))
+
+    def _check_meta(self, c, key, value):
+        """the stored value of `key`, storing `value` if there is none"""
+        row = c.execute("SELECT value FROM meta WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            if value is not None:
+                c.execute("INSERT INTO meta VALUES (?, ?)", (key, value))
+            return value
+        if value is not None and row[0] != value:
+            raise WorkQueueError("Queue '%s' was created with %s %r, not %r"
+                                 %(self.path, key, row[0], value))
+        return row[0]
+
+    @contextmanager
+    def _transaction(self):
+        c = self.conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except:
+            c.execute("ROLLBACK")
+            raise
+        else:
+            c.execute("COMMIT")
+
+    def claim(self, owner):
+        """the sentence id `owner` should work on, or None if all are done or taken"""
+        with self._transaction() as c:
+            now = self.clock()
+            row = c.execute("SELECT sent_id FROM claims WHERE owner = ? AND done = 0 "
+                            "ORDER BY sent_id LIMIT 1", (owner, )).fetchone()
+            if row is None:
+                row = c.execute("SELECT sent_id FROM claims WHERE done = 0 AND lease_until < ? "
+                                "ORDER BY sent_id LIMIT 1", (now, )).fetchone()
+            if row is not None:
+                c.execute("UPDATE claims SET owner = ?, lease_until = ? WHERE sent_id = ?",
+                          (owner, now + self.lease_seconds, row[0]))
+                return row[0]
+
+            frontier = c.execute("SELECT value FROM meta WHERE key = 'frontier'").fetchone()[0]
+            if frontier >= self.total:
+                return None
+            c.execute("INSERT INTO claims VALUES (?, ?, ?, 0)",
+                      (frontier, owner, now + self.lease_seconds))
+            c.execute("UPDATE meta SET value = ? WHERE key = 'frontier'", (frontier + 1, ))
+            return frontier
+
+    def renew(self, owner):
+        """Extend the leases of the unfinished claims of `owner`, returning how many there are"""
+        with self._transaction() as c:
+            c.execute("UPDATE claims SET lease_until = ? WHERE owner = ? AND done = 0",
+                      (self.clock() + self.lease_seconds, owner))
+            return c.rowcount
+
+    def complete(self, owner, sent_id):
+        """Mark `sent_id` as done, False if `owner` no longer holds it"""
+        with self._transaction() as c:
+            c.execute("UPDATE claims SET done = 1 WHERE sent_id = ? AND owner = ? AND done = 0",
+                      (sent_id, owner))
+            return c.rowcount == 1
+
+    def progress(self):
+        c = self.conn.cursor()
+        done, claimed, expired = c.execute(
+            "SELECT COALESCE(SUM(done), 0), COALESCE(SUM(done = 0 AND lease_until >= ?), 0), "
+            "COALESCE(SUM(done = 0 AND lease_until < ?), 0) FROM claims",
+            (self.clock(), self.clock())).fetchone()
+        return {"total": self.total, "done": done, "claimed": claimed, "expired": expired}
+
+    def close(self):
+        self.conn.close()
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Renews the leases of `owner` while the process lives, so that only
+    the claims of crashed annotators run out. Uses its own connection
+    as SQLite connections are not shared between threads
+    """
+    def __init__(self, queue_path, owner, lease_seconds):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue_path = queue_path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        queue = ClaimQueue(self.queue_path, lease_seconds = self.lease_seconds)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3.0):
+                queue.renew(self.owner)
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()